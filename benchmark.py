@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Callable, Dict, List, Literal, Optional
+
+from compiler import (FRISC_generator, IllegalStateError, SemanticAnalyzer, SemanticError,  # noqa: F401 sets up sys.path
+                      SyntaxAnalyzer, SyntaxError, tokenize)
+from LeksickiAnalizator import process
+
+# the tree dump indents every statement one level deeper than the one before it,
+# so the text pipeline grows quadratically and stops an order of magnitude earlier
+SIZES = {
+    'text': [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5],
+    'memory': [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],
+}
+STAGES = ['lex', 'syntax', 'semantic', 'frisc']
+
+# never defined by the generator, a use of it is a semantic error
+UNDEFINED = 'nedefinirana'
+
+
+class ProgramGenerator:
+    """Seeded random PJ programs, every name is defined before it is used unless an error is asked for.
+
+    Loops nest at most depth deep and parentheses expression_depth deep, assignments pick their
+    targets from identifiers names so a small count means many redefinitions and long use chains.
+    """
+
+    def __init__(self, seed: int = 0, depth: int = 3, expression_depth: int = 0, identifiers: int = 26):
+        self.random = random.Random(seed)
+        self.depth = depth
+        self.expression_depth = expression_depth
+        self.names = [f"x{i}" for i in range(identifiers)]
+
+        self.lines: List[str] = []
+        self.tokens = 0
+        self.statements = 0
+
+    def program(self, statements: Optional[int] = None, tokens: Optional[int] = None,
+                error: Optional[Literal["syntax", "semantic"]] = None) -> str:
+        """Stops after statements statements or once tokens tokens were written, whichever comes first."""
+        self.lines, self.tokens, self.statements = [], 0, 0
+        self.limit = (statements or sys.maxsize, tokens or sys.maxsize)
+
+        self.emit(0, ['rez', '=', '0'])
+        scope = ['rez']
+        while not self.done():
+            self.statement(scope, 0)
+
+        # an unclosed parenthesis is the one mistake the syntax analyzer reports wherever it is
+        index = self.random.randrange(1, len(self.lines) + 1)
+        if error == 'syntax':
+            self.lines.insert(index, "rez = ( rez")
+        elif error == 'semantic':
+            self.lines.insert(index, f"rez = rez + {UNDEFINED}")
+
+        return '\n'.join(self.lines) + '\n'
+
+    def done(self) -> bool:
+        return self.statements >= self.limit[0] or self.tokens >= self.limit[1]
+
+    def emit(self, level: int, lexemes: List[str]):
+        self.lines.append('    ' * level + ' '.join(lexemes))
+        self.tokens += len(lexemes)
+        self.statements += 1
+
+    def statement(self, scope: List[str], level: int):
+        if level < self.depth and self.random.random() < 0.25:
+            self.loop(scope, level)
+        else:
+            self.assignment(scope, level)
+
+    def assignment(self, scope: List[str], level: int):
+        target = self.random.choice(self.names)
+        self.emit(level, [target, '=', *self.expression(scope, self.expression_depth)])
+        if target not in scope:
+            scope.append(target)
+
+    def loop(self, scope: List[str], level: int):
+        # the iterator is declared before its bounds are read, so they must not use it
+        iterator = self.random.choice(self.names)
+        bounds = [name for name in scope if name != iterator]
+        self.emit(level, ['za', iterator, 'od', *self.expression(bounds, 0),
+                          'do', *self.expression(bounds, self.expression_depth)])
+
+        inner = [*bounds, iterator]
+        for _ in range(self.random.randint(1, 4)):
+            self.statement(inner, level + 1)
+            if self.done():
+                break
+
+        self.emit(level, ['az'])
+
+    def expression(self, scope: List[str], depth: int) -> List[str]:
+        lexemes = self.term(scope, depth)
+        for _ in range(self.random.randint(0, 2)):
+            lexemes.extend([self.random.choice('+-'), *self.term(scope, depth)])
+
+        return lexemes
+
+    def term(self, scope: List[str], depth: int) -> List[str]:
+        lexemes = self.primary(scope, depth)
+        for _ in range(self.random.choice([0, 0, 1])):
+            lexemes.extend([self.random.choice('*/'), *self.primary(scope, depth)])
+
+        return lexemes
+
+    def primary(self, scope: List[str], depth: int) -> List[str]:
+        choice = self.random.random()
+        if depth > 0 and choice < 0.2:
+            return ['(', *self.expression(scope, depth - 1), ')']
+        if choice < 0.3:
+            return ['-', *self.primary(scope, depth)]
+        if scope and choice < 0.7:
+            return [self.random.choice(scope)]
+
+        return [str(self.random.randint(0, 100))]
+
+
+def captured(function: Callable[[], None]) -> str:
+    io = StringIO()
+    with redirect_stdout(io):
+        function()
+    return io.getvalue()
+
+
+def timed(function: Callable[[], str], repeat: int):
+    """Best wall time of repeat runs and what the last one returned."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def bench_text(source: str, repeat: int = 1) -> Dict[str, float]:
+    """Times every stage on the text output of the one before, like the lab scripts piped together.
+
+    A stage that reports an error ends the run, its output is not a valid input for the next one.
+    The generator has no parentheses, programs with them are not timed there.
+    """
+    times = {}
+    times['lex'], tokens = timed(lambda: captured(lambda: process(source)), repeat)
+
+    def syntax():
+        out = StringIO()
+        SyntaxAnalyzer(tokens).run(out)
+        return out.getvalue()
+
+    times['syntax'], tree = timed(syntax, repeat)
+    if not tree.startswith('<program>'):
+        return times
+
+    times['semantic'], uses = timed(lambda: captured(lambda: SemanticAnalyzer(tree).run()), repeat)
+    if uses.endswith('\n') and uses.splitlines()[-1].startswith('err'):
+        return times
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'a.frisc')
+        try:
+            times['frisc'], _ = timed(lambda: FRISC_generator(tree).run(path), repeat)
+        except IllegalStateError:
+            pass
+
+    return times
+
+
+def failing(function: Callable):
+    """What function returns or the error it stopped at, so a failing stage still gets its time."""
+    try:
+        return function()
+    except (SyntaxError, SemanticError, IllegalStateError) as e:
+        return e
+
+
+def bench_memory(source: str, repeat: int = 1) -> Dict[str, float]:
+    """Times the stages on each other's objects, the way compiler.compile chains them."""
+    times = {}
+    times['lex'], tokens = timed(lambda: list(tokenize(source)), repeat)
+
+    times['syntax'], tree = timed(lambda: failing(lambda: SyntaxAnalyzer(tokens).parse()), repeat)
+    if isinstance(tree, Exception):
+        return times
+
+    times['semantic'], uses = timed(lambda: failing(lambda: list(SemanticAnalyzer(tree).analyze())), repeat)
+    if isinstance(uses, Exception):
+        return times
+
+    time, code = timed(lambda: failing(lambda: FRISC_generator(tree).generate()), repeat)
+    if not isinstance(code, Exception):
+        times['frisc'] = time
+
+    return times
+
+
+PIPELINES = {'text': bench_text, 'memory': bench_memory}
+
+
+def run(pipeline: str, sizes: List[int], seed: int, depth: int, expression_depth: int, identifiers: int,
+        error: Optional[str], repeat: int) -> dict:
+    results = []
+    for size in sizes:
+        generator = ProgramGenerator(seed, depth, expression_depth, identifiers)
+        source = generator.program(tokens=size, error=error)
+        times = PIPELINES[pipeline](source, repeat)
+        results.append({
+            'size': size,
+            'tokens': generator.tokens,
+            'statements': generator.statements,
+            'times': times,
+        })
+
+        stages = '  '.join(f"{stage} {times[stage]:9.4f}s" if stage in times else f"{stage} {'-':>10}"
+                           for stage in STAGES)
+        print(f"{size:>8} tokens  {stages}", flush=True)
+
+    return {
+        'python': platform.python_version(),
+        'pipeline': pipeline,
+        'seed': seed,
+        'depth': depth,
+        'expression_depth': expression_depth,
+        'identifiers': identifiers,
+        'error': error,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(current: dict, previous: dict):
+    before = {result['size']: result['times'] for result in previous['results']}
+    for result in current['results']:
+        old = before.get(result['size'])
+        if old is None:
+            continue
+
+        ratios = '  '.join(f"{stage} {result['times'][stage] / old[stage]:6.2f}x"
+                           for stage in STAGES if stage in result['times'] and old.get(stage))
+        print(f"{result['size']:>8} tokens  {ratios}")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Times every stage on generated PJ programs of growing size')
+    parser.add_argument('--pipeline', choices=list(PIPELINES), default='text',
+                        help='time the run entry points on text dumps or the stages on in-memory objects')
+    parser.add_argument('--sizes', type=int, nargs='+', default=None,
+                        help='approximate token counts of the generated programs, up to 1e5 for text and 1e6 in memory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=3, help='deepest loop nesting')
+    parser.add_argument('--expression-depth', type=int, default=0,
+                        help='deepest parentheses nesting, the frisc stage is skipped above 0')
+    parser.add_argument('--identifiers', type=int, default=26, help='distinct variable names')
+    parser.add_argument('--error', choices=['syntax', 'semantic'], default=None,
+                        help='make the programs invalid, stages after the failing one are not timed')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the best one counts')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write the results as json')
+    parser.add_argument('--compare', metavar='FILE', help='json of an earlier run to print speedups against')
+    parser.add_argument('--dump', metavar='FILE', help='only write the program of the first size to FILE')
+    args = parser.parse_args(argv)
+    sizes = args.sizes or SIZES[args.pipeline]
+
+    if args.dump:
+        generator = ProgramGenerator(args.seed, args.depth, args.expression_depth, args.identifiers)
+        with open(args.dump, 'w') as f:
+            f.write(generator.program(tokens=sizes[0], error=args.error))
+        return 0
+
+    current = run(args.pipeline, sizes, args.seed, args.depth, args.expression_depth, args.identifiers,
+                  args.error, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print()
+        compare(current, previous)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
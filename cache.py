@@ -0,0 +1,123 @@
+import hashlib
+import os
+import tempfile
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# bump when the entry format changes, the stage sources are hashed into the keys on their own
+FORMAT = 1
+DEFAULT_SIZE = 256 * 1024 * 1024
+
+
+class Entry(NamedTuple):
+    """A stage either produced text or stopped with an error message, both are worth remembering."""
+    text: Optional[str]
+    error: Optional[str]
+
+    def dump(self) -> str:
+        return f"ok\n{self.text}" if self.error is None else f"err\n{self.error}"
+
+    @staticmethod
+    def load(data: str) -> "Entry":
+        status, _, body = data.partition('\n')
+        return Entry(body, None) if status == 'ok' else Entry(None, body)
+
+
+def fingerprint(paths: Iterable[str]) -> str:
+    """Hash of the sources of a stage, so editing the compiler invalidates what it produced."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class CompilationCache:
+    """Content addressed store of stage outputs on disk, an entry is named by the hash of what produced it.
+
+    Writes go to a temporary file that is renamed into place, so concurrent workers and
+    interrupted builds never leave half an entry behind. Hits refresh the modification time
+    and evict drops the least recently used entries until the store fits in max_size bytes.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_SIZE, salts: Optional[Dict[str, str]] = None):
+        self.directory = directory
+        self.max_size = max_size
+        self.salts = salts or {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, stage: str, *parts: str) -> str:
+        digest = hashlib.sha256(f"{FORMAT}\0{stage}\0{self.salts.get(stage, '')}".encode())
+        for part in parts:
+            digest.update(b'\0')
+            digest.update(part.encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key: str) -> Optional[Entry]:
+        path = self.path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return Entry.load(data)
+
+    def put(self, key: str, entry: Entry):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(entry.dump())
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return found
+
+    def evict(self) -> int:
+        """Removes the least recently used entries over max_size, returns how many went."""
+        entries = sorted(self.entries())
+        size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+
+        return removed
@@ -0,0 +1,267 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+for lab in ['ppj-lab1', 'ppj-lab2', 'ppj-lab3', 'ppj-lab4']:
+    sys.path.insert(0, os.path.join(ROOT, lab))
+
+from LeksickiAnalizator import Token, tokenize  # noqa: E402
+from SintaksniAnalizator import Node, SyntaxAnalyzer, SyntaxError  # noqa: E402
+from SemantickiAnalizator import SemanticAnalyzer, SemanticError  # noqa: E402
+from FRISCGenerator import FRISC_generator, IllegalStateError, Options, SourceOrigin  # noqa: E402
+from FRISCSimulator import FRISCError, profile  # noqa: E402
+from cache import DEFAULT_SIZE, CompilationCache, Entry, fingerprint  # noqa: E402
+
+# what every cached stage depends on besides its input
+STAGE_SOURCES = {
+    'tokens': [sys.modules[Token.__module__].__file__],
+    'tree': [sys.modules[Node.__module__].__file__],
+    'frisc': [sys.modules[SemanticAnalyzer.__module__].__file__, sys.modules[FRISC_generator.__module__].__file__],
+}
+
+
+@dataclass
+class Compilation:
+    tokens: List[Token]
+    tree: Node
+    uses: List[Tuple[int, int, str]]
+    code: List[str]
+    source_map: List[Optional[SourceOrigin]]
+
+    def lexer_dump(self) -> str:
+        return ''.join(f"{token}\n" for token in self.tokens)
+
+    def tree_dump(self) -> str:
+        return f"{self.tree}\n"
+
+    def semantic_dump(self) -> str:
+        return ''.join(f"{line} {def_line} {idn}\n" for line, def_line, idn in self.uses)
+
+    def frisc(self) -> str:
+        return ''.join(f"{line}\n" for line in self.code)
+
+
+def compile(source: Union[str, os.PathLike, BinaryIO]) -> Compilation:
+    """Runs all four stages in memory on the text, a path or a binary stream, raises SyntaxError or SemanticError."""
+    tokens = list(tokenize(source))
+    tree = SyntaxAnalyzer(tokens).parse()
+    uses = list(SemanticAnalyzer(tree).analyze())
+    generator = FRISC_generator(tree)
+    code = generator.generate()
+
+    return Compilation(tokens, tree, uses, code, generator.source_map)
+
+
+class BatchResult(NamedTuple):
+    path: str
+    code: Optional[str]
+    error: Optional[str]
+    cached: bool = False
+
+
+def open_cache(directory: str, max_size: int = DEFAULT_SIZE) -> CompilationCache:
+    salts = {stage: fingerprint(paths) for stage, paths in STAGE_SOURCES.items()}
+    return CompilationCache(directory, max_size, salts)
+
+
+def failure(e: Exception) -> str:
+    if isinstance(e, (SyntaxError, SemanticError)):
+        return str(e)
+    return f"{e.__class__.__name__}: {e}"
+
+
+# deterministic failures of a stage, cached like its output
+ERRORS = (SyntaxError, SemanticError, IllegalStateError, NotImplementedError, KeyError, IndexError, ValueError)
+
+
+def generate(tree, options: Optional[Options] = None) -> str:
+    """Checks and translates a tree or a tree dump, the last two stages."""
+    list(SemanticAnalyzer(tree).analyze())
+    return ''.join(f"{line}\n" for line in FRISC_generator(tree, options).generate())
+
+
+def compile_cached(source: str, cache: CompilationCache, options: Optional[Options] = None) -> Tuple[Entry, bool]:
+    """Every stage looks up the output of the one before it, so an edit that leaves the tokens
+    or the tree alone stops there. Returns the frisc code or the error that stopped it and
+    whether that came from the cache."""
+    if source.lstrip().startswith('<program>'):
+        tree = dump = source
+    else:
+        key = cache.key('tokens', source)
+        tokens = cache.get(key)
+        if tokens is None:
+            tokens = Entry(''.join(f"{token}\n" for token in tokenize(source)), None)
+            cache.put(key, tokens)
+
+        key = cache.key('tree', tokens.text)
+        entry = cache.get(key)
+        tree = None
+        if entry is None:
+            try:
+                tree = SyntaxAnalyzer(tokens.text).parse()
+                entry = Entry(f"{tree}\n", None)
+            except ERRORS as e:
+                entry = Entry(None, failure(e))
+                cache.put(key, entry)
+                return entry, False
+            cache.put(key, entry)
+
+        if entry.error is not None:
+            return entry, True
+
+        dump = entry.text
+        tree = tree or dump
+
+    key = cache.key('frisc', dump, repr(options or Options()))
+    entry = cache.get(key)
+    if entry is not None:
+        return entry, True
+
+    try:
+        entry = Entry(generate(tree, options), None)
+    except ERRORS as e:
+        entry = Entry(None, failure(e))
+    cache.put(key, entry)
+
+    return entry, False
+
+
+def compile_file(path: str, cache: Optional[CompilationCache] = None) -> BatchResult:
+    """Compiles a .pj program or a <program> tree dump, errors are returned instead of raised."""
+    with open(path) as f:
+        source = f.read()
+
+    if cache is not None:
+        entry, cached = compile_cached(source, cache)
+        return BatchResult(path, entry.text, entry.error, cached)
+
+    try:
+        if source.lstrip().startswith('<program>'):
+            code = generate(source)
+        else:
+            code = compile(source).frisc()
+    except ERRORS as e:
+        return BatchResult(path, None, failure(e))
+
+    return BatchResult(path, code, None)
+
+
+def collect(paths: Iterable[str]) -> List[str]:
+    """Expands directories to the .pj files inside them, sorted so batches are reproducible."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+
+        found = []
+        for directory, _, names in os.walk(path):
+            found.extend(os.path.join(directory, name) for name in names if name.endswith('.pj'))
+        files.extend(sorted(found))
+
+    return files
+
+
+def compile_batch(paths: Iterable[str], workers: Optional[int] = None,
+                  cache: Optional[CompilationCache] = None) -> List[BatchResult]:
+    """Compiles every input on a process pool, results keep the order of the inputs."""
+    files = collect(paths)
+    if not files:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(files) // (workers * 4))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(partial(compile_file, cache=cache), files, chunksize=chunksize))
+
+
+def output_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}.frisc"
+
+
+def write_if_changed(path: str, text: str) -> bool:
+    """Leaves an up to date output alone so its modification time does not trigger rebuilds downstream."""
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+
+    with open(path, 'w') as f:
+        f.write(text)
+    return True
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='PJ to FRISC compiler')
+    parser.add_argument('output', nargs='?', default='a.frisc',
+                        help='where to write the program read from stdin')
+    parser.add_argument('--batch', nargs='+', metavar='PATH',
+                        help='.pj files, tree dumps or directories to compile next to their sources')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes for --batch, defaults to the CPU count')
+    parser.add_argument('--profile', action='store_true',
+                        help='run the program read from stdin and report cycles per source line and runtime routine')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='reuse the output of every stage whose input did not change since an earlier build')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_SIZE // (1024 * 1024), metavar='MB',
+                        help='least recently used cache entries are dropped above this size')
+    args = parser.parse_args(argv)
+
+    cache = open_cache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+
+    if args.batch is None and cache is not None and not args.profile:
+        entry, _ = compile_cached(sys.stdin.read(), cache)
+        cache.evict()
+        if entry.error is not None:
+            print(entry.error)
+            return 1
+
+        write_if_changed(args.output, entry.text)
+        return 0
+
+    if args.batch is None:
+        try:
+            result = compile(sys.stdin.buffer)
+        except (SyntaxError, SemanticError) as e:
+            print(e)
+            return 1
+
+        if args.profile:
+            try:
+                print(profile(result.frisc(), result.source_map).report())
+            except FRISCError as e:
+                print(e)
+                return 1
+            return 0
+
+        with open(args.output, 'w') as f:
+            f.write(result.frisc())
+        return 0
+
+    results = compile_batch(args.batch, args.jobs, cache)
+    failed = 0
+    for result in results:
+        if result.error is not None:
+            failed += 1
+            print(f"{result.path}: {result.error}")
+            continue
+
+        write_if_changed(output_path(result.path), result.code)
+
+    summary = f"Compiled {len(results) - failed}/{len(results)}"
+    if cache is not None:
+        cache.evict()
+        summary += f", {sum(result.cached for result in results)} from cache"
+    print(summary)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
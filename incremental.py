@@ -0,0 +1,178 @@
+import sys
+from dataclasses import replace
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from compiler import (FRISC_generator, IllegalStateError, Node, Options, SemanticAnalyzer,  # noqa: F401 sets up sys.path
+                      SemanticError, SyntaxAnalyzer, SyntaxError, Token, compile, tokenize)
+from FRISCGenerator import PROLOGUE, CompilationContext, Fragment, SourceOrigin, epilogue, format_code
+
+
+class Chunk(NamedTuple):
+    """A top-level statement, one assignment line or a za ... az block, lexed and parsed on its own.
+
+    Tokens count lines from the start of the chunk, so a chunk that only moves keeps all of this.
+    """
+    tokens: List[Token]
+    tree: Node
+    # top-level variable the chunk declares, loops declare theirs in their own scope
+    defines: Optional[str]
+    mentions: FrozenSet[str]
+
+
+class Irregular(Exception):
+    """The source can't be cut into chunks that parse the same on their own, only a full build will do."""
+
+
+class IncrementalCompiler:
+    """Keeps the tokens, trees and generated code of every top-level statement between builds.
+
+    update cuts the new source into chunks and only lexes, parses, checks and generates chunks
+    it has not seen with the same variables declared before them, everything else is spliced
+    from earlier builds. Dead store elimination looks at the whole program so it is off here.
+    Errors, and sources whose statements span lines the chunks can't follow, go through a full
+    build, which reports them exactly like compile does.
+    """
+
+    def __init__(self, options: Optional[Options] = None):
+        self.options = replace(options or Options(), eliminate_dead_stores=False)
+        self.lines: Dict[str, List[Tuple[str, str]]] = {}
+        self.chunks: Dict[Tuple[str, ...], Chunk] = {}
+        self.fragments: Dict[tuple, Fragment] = {}
+        self.namespaces = 0
+
+        self.source_map: List[Optional[SourceOrigin]] = []
+        # chunks generated and reused by the last update, full says whether it fell back to compile
+        self.generated = 0
+        self.reused = 0
+        self.full = False
+
+    def update(self, source: str) -> List[str]:
+        self.generated = self.reused = 0
+        self.full = False
+        try:
+            return self.splice(source)
+        except (Irregular, SyntaxError, SemanticError, IllegalStateError, IndexError):
+            self.full = True
+            result = compile(source)
+            self.source_map = result.source_map
+            return result.code
+
+    def lex(self, line: str) -> List[Tuple[str, str]]:
+        lexemes = self.lines.get(line)
+        if lexemes is None:
+            lexemes = [(token.klass, token.lexeme) for token in tokenize(line)]
+            self.lines[line] = lexemes
+        return lexemes
+
+    def cut(self, source: str) -> List[Tuple[int, Tuple[str, ...]]]:
+        """Splits the source into chunks, each with the number of lines before it."""
+        lines = source.splitlines()
+        chunks = []
+        start = None
+        depth = 0
+        for number, line in enumerate(lines):
+            lexemes = self.lex(line)
+            if not lexemes:
+                continue
+
+            if start is None:
+                start = number
+            for position, (klass, _) in enumerate(lexemes):
+                depth += klass == 'KR_ZA'
+                depth -= klass == 'KR_AZ'
+                if depth < 0 or depth == 0 and klass == 'KR_AZ' and position != len(lexemes) - 1:
+                    raise Irregular
+
+            if depth == 0:
+                chunks.append((start, tuple(lines[start:number + 1])))
+                start = None
+
+        if depth != 0 or not chunks:
+            raise Irregular
+
+        # only lines seen this time stay cached
+        self.lines = {line: self.lines[line] for line in lines if line in self.lines}
+        return chunks
+
+    def chunk(self, lines: Tuple[str, ...]) -> Chunk:
+        chunk = self.chunks.get(lines)
+        if chunk is not None:
+            return chunk
+
+        tokens = [Token(klass, number, lexeme)
+                  for number, line in enumerate(lines, 1) for klass, lexeme in self.lex(line)]
+        tree = SyntaxAnalyzer(tokens).parse()
+
+        statements = tree.children[0].children
+        if len(statements) != 2 or len(statements[1].children) != 1:
+            raise Irregular
+
+        defines = tokens[0].lexeme if tokens[0].klass == 'IDN' else None
+        mentions = frozenset(token.lexeme for token in tokens if token.klass == 'IDN')
+        chunk = Chunk(tokens, tree, defines, mentions)
+        self.chunks[lines] = chunk
+        return chunk
+
+    def fragment(self, chunk: Chunk, defined: FrozenSet[str]) -> Fragment:
+        analyzer = SemanticAnalyzer(chunk.tokens)
+        for name in defined:
+            analyzer.symbols.declare(name, 0)
+        list(analyzer.analyze())
+
+        self.namespaces += 1
+        generator = FRISC_generator(chunk.tree, self.options)
+        return generator.fragment(defined, f"c{self.namespaces}_")
+
+    def splice(self, source: str) -> List[str]:
+        ctx = CompilationContext(self.options)
+        code = format_code(PROLOGUE)
+        source_map: List[Optional[SourceOrigin]] = [None] * len(code)
+        variables = {label: None for label in ctx.list()}
+
+        declared = set()
+        seen: Dict[tuple, int] = {}
+        fragments = {}
+        for offset, lines in self.cut(source):
+            chunk = self.chunk(lines)
+
+            # the chunk only depends on which of its names were declared before it, the same
+            # chunk twice with the same declarations needs two copies for distinct labels
+            defined = chunk.mentions & declared
+            key = (lines, defined)
+            occurrence = seen.get(key, 0)
+            seen[key] = occurrence + 1
+            key = (lines, defined, occurrence)
+
+            fragment = self.fragments.get(key)
+            if fragment is None:
+                fragment = self.fragment(chunk, defined)
+                self.generated += 1
+            else:
+                self.reused += 1
+            fragments[key] = fragment
+
+            code.extend(fragment.code)
+            source_map.extend(origin if origin is None or not origin.line else origin._replace(line=origin.line + offset)
+                              for origin in fragment.source_map)
+            variables.update(dict.fromkeys(fragment.variables))
+            ctx.has_multiply_or_divide = ctx.has_multiply_or_divide or fragment.multiply_or_divide
+
+            if chunk.defines is not None:
+                declared.add(chunk.defines)
+
+        # fragments of chunks that are gone are not worth keeping
+        self.fragments = fragments
+        self.chunks = {key[0]: self.chunks[key[0]] for key in fragments}
+
+        lines, origins = epilogue(ctx, list(variables))
+        code.extend(format_code(lines))
+        source_map.extend(origins)
+
+        self.source_map = source_map
+        return code
+
+
+if __name__ == '__main__':
+    compiler = IncrementalCompiler()
+    for line in compiler.update(sys.stdin.read()):
+        print(line)
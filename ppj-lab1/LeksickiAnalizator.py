@@ -1,33 +1,141 @@
+import mmap
+import os
+import re
+import stat
+import struct
 import sys
+from typing import BinaryIO, Iterator, List, NamedTuple, TextIO, Union
 
 KNOWN = {'=': 'OP_PRIDRUZI', '+': 'OP_PLUS', '-': 'OP_MINUS', '*': 'OP_PUTA', '/': 'OP_DIJELI', '(': 'L_ZAGRADA', ')': 'D_ZAGRADA',
          'az': 'KR_AZ', 'za': 'KR_ZA', 'od': 'KR_OD', 'do': 'KR_DO'}
 
+# numbers, identifiers (keywords are looked up in KNOWN) and single character operators,
+# anything else between them is skipped by findall
+LEXEME = re.compile(r"\d+|[^\W\d]\w*|[=+\-*/()]")
 
-def process_line(token, i):
-    if token in KNOWN:
-        print(f"{KNOWN[token]} {i+1} {token}")
-    elif token.isnumeric():
-        print(f"BROJ {i+1} {token}")
-    elif token.isidentifier():
-        print(f"IDN {i+1} {token}")
-    elif len(token) > 1:
-        tmp = ''
-        for j in token:
-            tmp += j
-            if j in KNOWN:
-                if tmp[:-1]:
-                    process_line(tmp[:-1], i)
-                process_line(j, i)
-                tmp = ''
-        process_line(tmp, i)
+# a binary token record is the index of its class in CLASSES, its line and the length of the
+# utf-8 lexeme that follows it
+CLASSES = ['IDN', 'BROJ', *KNOWN.values()]
+CLASS_INDEX = {klass: i for i, klass in enumerate(CLASSES)}
+RECORD = struct.Struct('<BII')
 
 
-def process(text: str):
-    for i, line in enumerate([rl.split('//')[0].strip() for rl in text.splitlines()]):
-        for token in line.split():
-            process_line(token, i)
+class Token(NamedTuple):
+    klass: str
+    line: int
+    lexeme: str
+
+    def __str__(self):
+        return f"{self.klass} {self.line} {self.lexeme}"
+
+
+def read_lines(source: Union[os.PathLike, BinaryIO]) -> Iterator[str]:
+    """Lines of a path or a binary stream one at a time, a regular file is mapped instead of read."""
+    if isinstance(source, os.PathLike):
+        with open(source, 'rb') as f:
+            yield from read_lines(f)
+        return
+
+    mapped = None
+    try:
+        if stat.S_ISREG(os.fstat(source.fileno()).st_mode):
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            mapped.seek(source.tell())
+    except (AttributeError, OSError, ValueError):
+        # pipes, terminals, in-memory streams and empty files are read line by line
+        mapped = None
+
+    try:
+        for line in iter(mapped.readline, b'') if mapped is not None else source:
+            # splitlines also breaks on a lone \r, like it did on the whole text
+            yield from line.decode().splitlines() or ['']
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def tokenize(text: Union[str, os.PathLike, BinaryIO]) -> Iterator[Token]:
+    """Tokens of the source text, or of a path or binary stream read one line at a time."""
+    lines = text.splitlines() if isinstance(text, str) else read_lines(text)
+    for i, line in enumerate(lines, 1):
+        comment = line.find('//')
+        if comment != -1:
+            line = line[:comment]
+
+        for lexeme in LEXEME.findall(line):
+            if lexeme in KNOWN:
+                yield Token(KNOWN[lexeme], i, lexeme)
+            elif lexeme[0].isdigit():
+                yield Token('BROJ', i, lexeme)
+            else:
+                yield Token('IDN', i, lexeme)
+
+
+class TextWriter:
+    """Writes tokens a line each, joined into one write every chunk_size characters."""
+
+    def __init__(self, sink: TextIO, chunk_size=64 * 1024):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.chunk: List[str] = []
+        self.size = 0
+
+    def write(self, token: Token):
+        line = f"{token}\n"
+        self.chunk.append(line)
+        self.size += len(line)
+
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.sink.write(''.join(self.chunk))
+        self.chunk = []
+        self.size = 0
+
+
+class RecordWriter:
+    """Packs tokens into binary records, read_records turns them back into tokens."""
+
+    def __init__(self, sink: BinaryIO, chunk_size=64 * 1024):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.chunk = bytearray()
+
+    def write(self, token: Token):
+        lexeme = token.lexeme.encode()
+        self.chunk += RECORD.pack(CLASS_INDEX[token.klass], token.line, len(lexeme))
+        self.chunk += lexeme
+
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.sink.write(self.chunk)
+        self.chunk = bytearray()
+
+
+def read_records(data: bytes) -> Iterator[Token]:
+    """Tokens of what RecordWriter wrote, data can be anything with the buffer protocol like an mmap."""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        klass, line, length = RECORD.unpack_from(view, offset)
+        offset += RECORD.size
+        yield Token(CLASSES[klass], line, bytes(view[offset:offset + length]).decode())
+        offset += length
+
+
+def process(text: Union[str, os.PathLike, BinaryIO], writer: Union[TextWriter, RecordWriter, None] = None):
+    writer = writer or TextWriter(sys.stdout)
+    try:
+        for token in tokenize(text):
+            writer.write(token)
+    finally:
+        writer.flush()
 
 
 if __name__ == '__main__':
-    process(sys.stdin.read())
+    # --binary writes token records instead of text, for SyntaxAnalyzer(read_records(...))
+    binary = '--binary' in sys.argv[1:]
+    process(sys.stdin.buffer, RecordWriter(sys.stdout.buffer) if binary else None)
@@ -1,56 +1,262 @@
+import mmap
+import os
+import shutil
+import stat
 import sys
-from typing import Union
+import tempfile
+from typing import BinaryIO, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Union
+
+# trees bigger than this are spooled to a temporary file until parsing succeeds
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class Token(NamedTuple):
+    klass: str
+    line: int
+    lexeme: str
+
+    def __str__(self):
+        return f"{self.klass} {self.line} {self.lexeme}"
+
+    @staticmethod
+    def parse(line: str) -> "Token":
+        klass, line_number, lexeme = line.split()
+        return Token(klass, int(line_number), lexeme)
+
+
+class Node:
+    __slots__ = ('label', 'children')
+
+    def __init__(self, label: str):
+        self.label = label
+        self.children: List[Union["Node", Token, str]] = []
+
+    def leaves(self) -> Iterator[Token]:
+        stack = [iter(self.children)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            elif isinstance(child, Node):
+                stack.append(iter(child.children))
+            elif isinstance(child, tuple):
+                yield child
+
+    def lines(self) -> Iterator[str]:
+        yield self.label
+        stack = [iter(self.children)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            elif isinstance(child, Node):
+                yield f"{' ' * len(stack)}{child.label}"
+                stack.append(iter(child.children))
+            else:
+                yield f"{' ' * len(stack)}{child}"
+
+    def __str__(self) -> str:
+        return '\n'.join(self.lines())
+
+
+class TreeBuilder:
+    def __init__(self):
+        self.root: Optional[Node] = None
+        self.stack: List[Node] = []
+
+    def open(self, label: str):
+        node = Node(label)
+        if self.stack:
+            self.stack[-1].children.append(node)
+        else:
+            self.root = node
+        self.stack.append(node)
+
+    def leaf(self, item: Union[Token, str]):
+        self.stack[-1].children.append(item)
+
+    def close(self):
+        self.stack.pop()
+
+
+class TreeWriter:
+    def __init__(self, sink: TextIO, chunk_lines=4096, chunk_size=1024 * 1024, cached_indents=256):
+        self.sink = sink
+        self.chunk_lines = chunk_lines
+        # deep trees have lines of thousands of spaces, so the chunk is bounded in characters too
+        self.chunk_size = chunk_size
+        self.prefixes = [' ' * i for i in range(cached_indents)]
+
+        self.indent = 0
+        self.chunk: List[str] = []
+        self.size = 0
+
+    def _write(self, text: str):
+        prefix = self.prefixes[self.indent] if self.indent < len(
+            self.prefixes) else ' ' * self.indent
+        line = f"{prefix}{text}\n"
+        self.chunk.append(line)
+        self.size += len(line)
+
+        if len(self.chunk) >= self.chunk_lines or self.size >= self.chunk_size:
+            self.flush()
+
+    def open(self, label: str):
+        self._write(label)
+        self.indent += 1
+
+    def leaf(self, item: Union[Token, str]):
+        self._write(str(item))
+
+    def close(self):
+        self.indent -= 1
+
+    def flush(self):
+        self.sink.write(''.join(self.chunk))
+        self.chunk = []
+        self.size = 0
+
+
+class TailCall(NamedTuple):
+    routine: Iterator
+    closes: int
+
+
+def read_lines(source: Union[os.PathLike, BinaryIO]) -> Iterator[str]:
+    """Lines of a path or a binary stream one at a time, a regular file is mapped instead of read.
+
+    A copy of the one in ppj-lab1, every lab is handed in on its own.
+    """
+    if isinstance(source, os.PathLike):
+        with open(source, 'rb') as f:
+            yield from read_lines(f)
+        return
+
+    mapped = None
+    try:
+        if stat.S_ISREG(os.fstat(source.fileno()).st_mode):
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            mapped.seek(source.tell())
+    except (AttributeError, OSError, ValueError):
+        # pipes, terminals, in-memory streams and empty files are read line by line
+        mapped = None
+
+    try:
+        for line in iter(mapped.readline, b'') if mapped is not None else source:
+            # splitlines also breaks on a lone \r, like it did on the whole text
+            yield from line.decode().splitlines() or ['']
+    finally:
+        if mapped is not None:
+            mapped.close()
 
 
 class SyntaxError(Exception):
-    def __init__(self, message: Union[str, list]):
-        self.message = ' '.join(message) if isinstance(
-            message, list) else message
+    def __init__(self, message: Union[str, list, tuple]):
+        self.message = ' '.join(map(str, message)) if isinstance(
+            message, (list, tuple)) else message
 
     def __str__(self):
         return f"err {self.message}"
 
 
 class SyntaxAnalyzer:
-    def __init__(self, text: str):
+    def __init__(self, source: Union[str, os.PathLike, BinaryIO, Iterable[Token]]):
+        # the grouped lines are the only copy of the program, parentheses are checked on all
+        # of it before anything is parsed
         self.instructions = []
-        self.raw_lines = list(map(lambda x: x.split(), text.splitlines()))
+        if isinstance(source, str):
+            self.tokens = (Token.parse(line)
+                           for line in source.splitlines() if line.strip())
+        elif isinstance(source, os.PathLike) or hasattr(source, 'read'):
+            self.tokens = (Token.parse(line)
+                           for line in read_lines(source) if line.strip())
+        else:
+            self.tokens = map(Token._make, source)
 
         self.iLine = 0
         self.iInst = 0
 
-        self.indent = 0
-        self.buffer = []
+        self.builder: Union[TreeBuilder, TreeWriter, None] = None
 
-    def run(self):
-        try:
-            self._process()
-            print('\n'.join(self.buffer))
-        except SyntaxError as e:
-            print(e)
+    def run(self, out: Optional[TextIO] = None):
+        out = out or sys.stdout
+
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode='w+') as spool:
+            try:
+                self.write(spool)
+            except SyntaxError as e:
+                print(e, file=out)
+                return
+
+            spool.seek(0)
+            shutil.copyfileobj(spool, out)
+
+    def parse(self) -> Node:
+        self.builder = TreeBuilder()
+        self._process()
+        return self.builder.root
+
+    def write(self, sink: TextIO):
+        """Writes the tree to sink while parsing, a SyntaxError leaves it half written."""
+        self.builder = TreeWriter(sink)
+        self._process()
+        self.builder.flush()
 
     def _process(self):
+        self._group()
+
+        self._print('<program>', 1)
+
+        self._run(self._process_instruction_list())
+
+        self.iLine = 0
+        if len(self.instructions) > 0 and len(self.instructions[self.iLine]) == 0:
+            raise SyntaxError('kraj')
+
+    def _group(self):
+        """Groups the token stream by line number and counts parentheses in the same pass."""
+        add = False
+        last = ""
+        count = 0
+
+        for token in self.tokens:
+            if self.instructions and token.line == self.instructions[-1][0].line:
+                self.instructions[-1].append(token)
+            elif not self.instructions or token.line > self.instructions[-1][0].line:
+                if add and token.klass == 'IDN':
+                    add = False
+                    last = token
+
+                self.instructions.append([token])
+            else:
+                self._group_sorted([*(t for line in self.instructions for t in line), token, *self.tokens])
+                return
+
+            if token.klass == 'L_ZAGRADA':
+                add = True
+                count += 1
+            elif token.klass == 'D_ZAGRADA':
+                add = True
+                count -= 1
+
+        if count != 0:
+            raise SyntaxError(last)
+
+    def _group_sorted(self, tokens: List[Token]):
         dict = {}
-        for line in self.raw_lines:
-            line_number = int(line[1])
+        for line in tokens:
+            line_number = line.line
             if line_number not in dict:
                 dict[line_number] = []
 
             dict[line_number].append(line)
 
+        self.instructions = []
         for k in sorted(dict.keys()):
             self.instructions.append(dict[k])
 
         self._check_parentheses()
 
-        self._print('<program>', 1)
-
-        self._process_instruction_list()
-
-        self.iLine = 0
-        if len(self.instructions) > 0 and len(self.instructions[self.iLine]) == 0:
-            raise SyntaxError('kraj')
-
     def _check_parentheses(self):
         add = False
         last = ""
@@ -72,12 +278,34 @@ class SyntaxAnalyzer:
         if count != 0:
             raise SyntaxError(last)
 
-    def _print(self, text: Union[str, tuple], indent=0):
-        if isinstance(text, list):
-            text = ' '.join(text)
+    def _print(self, text: Union[str, Token], indent=0):
+        if indent > 0:
+            self.builder.open(text)
+            return
 
-        self.buffer.append(f"{' ' * self.indent}{text}")
-        self.indent += indent
+        self.builder.leaf(text)
+        if indent < 0:
+            self.builder.close()
+
+    def _close(self):
+        self.builder.close()
+
+    def _run(self, routine: Iterator):
+        stack = [routine]
+        closes = [0]
+
+        while stack:
+            call = next(stack[-1], None)
+            if call is None:
+                stack.pop()
+                for _ in range(closes.pop()):
+                    self._close()
+            elif isinstance(call, TailCall):
+                stack[-1] = call.routine
+                closes[-1] += call.closes
+            else:
+                stack.append(call)
+                closes.append(0)
 
     def _process_instruction_list(self):
         self._print('<lista_naredbi>', 1)
@@ -87,26 +315,27 @@ class SyntaxAnalyzer:
             return
 
         if self.__get_instruction() == 'IDN' or self.__get_instruction() == 'KR_ZA':
-            self._process_instruction()
+            yield self._process_instruction()
             self.iLine += 1
             self.iInst = 0
-            self._process_instruction_list()
+            yield TailCall(self._process_instruction_list(), 1)
+            return
         elif self.__get_instruction() == 'KR_AZ':
             self._print('$')
         elif self.__get_instruction() == 'OP_PRIDRUZI':
             raise SyntaxError(self.__get())
 
-        self.indent -= 1
+        self._close()
 
     def _process_instruction(self):
         self._print('<naredba>', 1)
 
         if self.__get_instruction() == 'IDN':
-            self._process_assignment()
+            yield TailCall(self._process_assignment(), 1)
         elif self.__get_instruction() == 'KR_ZA':
-            self._process_for()
-
-        self.indent -= 1
+            yield TailCall(self._process_for(), 1)
+        else:
+            self._close()
 
     def _process_assignment(self):
         self._print('<naredba_pridruzivanja>', 1)
@@ -124,13 +353,13 @@ class SyntaxAnalyzer:
             if self.__get_instruction(1) == 'OP_PRIDRUZI':
                 raise SyntaxError(self.__get(1))
 
-        self.__e()
+        yield self.__e()
 
         if self.__get_instruction() == 'OP_PRIDRUZI':
             self._print('$')
             self.iInst += 1
 
-        self.indent -= 1
+        self._close()
 
     def _process_for(self):
         self._print('<za_petlja>', 1)
@@ -139,7 +368,7 @@ class SyntaxAnalyzer:
             self.iInst += 1
 
         if self.__get_instruction() in ["OP_MINUS", "OP_PLUS", "BROJ", "IDN", "L_ZAGRADA"]:
-            self.__e()
+            yield self.__e()
         else:
             raise SyntaxError(self.__get())
 
@@ -147,17 +376,17 @@ class SyntaxAnalyzer:
         self.iInst += 1
 
         if self.__get_instruction() in ["OP_MINUS", "OP_PLUS", "BROJ", "IDN", "L_ZAGRADA"]:
-            self.__e()
+            yield self.__e()
         else:
             raise SyntaxError(self.__get(-1))
 
         self.iLine += 1
         self.iInst = 0
 
-        self._process_instruction_list()
+        yield self._process_instruction_list()
 
         self._print(self.instructions[self.iLine][0])
-        self.indent -= 1
+        self._close()
 
     def __get(self, offset=0):
         return self.instructions[self.iLine][self.iInst + offset]
@@ -168,13 +397,13 @@ class SyntaxAnalyzer:
     def __te_builder(self, label, run_fn, list_fn):
         self._print(f'<{label}>', 1)
         if self.__get_instruction() in ['IDN', 'BROJ', 'OP_PLUS', 'OP_MINUS', 'L_ZAGRADA']:
-            run_fn()
-            list_fn()
-
-        self.indent -= 1
+            yield run_fn()
+            yield TailCall(list_fn(), 1)
+        else:
+            self._close()
 
-    def __e(self): self.__te_builder('E', self.__t, self.__e_list)
-    def __t(self): self.__te_builder('T', self.__p, self.__t_list)
+    def __e(self): return self.__te_builder('E', self.__t, self.__e_list)
+    def __t(self): return self.__te_builder('T', self.__p, self.__t_list)
 
     def __e_list(self):
         self._print('<E_lista>', 1)
@@ -190,9 +419,10 @@ class SyntaxAnalyzer:
             self._print(self.__get())
             self.iInst += 1
 
-            self.__e()
+            yield TailCall(self.__e(), 1)
+            return
 
-        self.indent -= 1
+        self._close()
 
     def __t_list(self):
         self._print('<T_lista>', 1)
@@ -207,9 +437,10 @@ class SyntaxAnalyzer:
             self._print(self.__get())
             self.iInst += 1
 
-            self.__t()
+            yield TailCall(self.__t(), 1)
+            return
 
-        self.indent -= 1
+        self._close()
 
     def __p(self):
         self._print('<P>', 1)
@@ -222,19 +453,19 @@ class SyntaxAnalyzer:
 
             self.iInst += 1
             if self.__get_instruction() in ['IDN', 'BROJ', 'OP_PLUS', 'OP_MINUS', 'L_ZAGRADA']:
-                self.__p()
-                self.indent -= 1
+                yield TailCall(self.__p(), 1)
                 return
 
-            self.__e_list()
+            yield TailCall(self.__e_list(), 1)
+            return
         elif self.__get_instruction() == 'L_ZAGRADA':
             self._print(self.__get())
             self.iInst += 1
 
-            self.__e()
+            yield self.__e()
             self.__right_parentheses()
 
-        self.indent -= 1
+        self._close()
 
     def __right_parentheses(self):
         if self.__get_instruction() == 'D_ZAGRADA':
@@ -243,4 +474,4 @@ class SyntaxAnalyzer:
 
 
 if __name__ == '__main__':
-    SyntaxAnalyzer(sys.stdin.read()).run()
+    SyntaxAnalyzer(sys.stdin.buffer).run()
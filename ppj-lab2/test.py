@@ -18,12 +18,9 @@ def load_test(test):
 
 
 class MyStringIO(StringIO):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.output = ''
-
-    def write(self, s):
-        self.output += s
+    @property
+    def output(self):
+        return self.getvalue()
 
 
 if __name__ == '__main__':
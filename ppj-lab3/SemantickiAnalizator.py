@@ -1,79 +1,253 @@
+import mmap
+import os
+import stat
+import struct
 import sys
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, List, TextIO, Tuple, Union
 
+# a binary record is the line of a use, the line its name was defined on or 0 for an error,
+# and the length of the utf-8 name that follows it
+RECORD = struct.Struct('<III')
 
-class SemanticAnalyzer:
-    def __init__(self, input):
-        self.input = input
-        self.lines = input.splitlines()
 
-        self.global_vars: dict[str, int] = {}
-        self.scope_vars: list[dict[str, int]] = []
+def read_lines(source: Union[os.PathLike, BinaryIO]) -> Iterator[str]:
+    """Lines of a path or a binary stream one at a time, a regular file is mapped instead of read.
+
+    A copy of the one in ppj-lab1, every lab is handed in on its own.
+    """
+    if isinstance(source, os.PathLike):
+        with open(source, 'rb') as f:
+            yield from read_lines(f)
+        return
+
+    mapped = None
+    try:
+        if stat.S_ISREG(os.fstat(source.fileno()).st_mode):
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            mapped.seek(source.tell())
+    except (AttributeError, OSError, ValueError):
+        # pipes, terminals, in-memory streams and empty files are read line by line
+        mapped = None
+
+    try:
+        for line in iter(mapped.readline, b'') if mapped is not None else source:
+            # splitlines also breaks on a lone \r, like it did on the whole text
+            yield from line.decode().splitlines() or ['']
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+class SemanticError(Exception):
+    def __init__(self, line: int, idn: str):
+        self.line = line
+        self.idn = idn
+
+    def __str__(self):
+        return f"err {self.line} {self.idn}"
+
+
+class TextWriter:
+    """Writes uses and errors a line each, joined into one write every chunk_size characters."""
+
+    def __init__(self, sink: TextIO, chunk_size=64 * 1024):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.chunk: List[str] = []
+        self.size = 0
+
+    def write(self, line_number: int, def_line_number: int, idn: str):
+        self._append(f"{line_number} {def_line_number} {idn}\n")
+
+    def error(self, error: SemanticError):
+        self._append(f"{error}\n")
+
+    def _append(self, line: str):
+        self.chunk.append(line)
+        self.size += len(line)
+
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.sink.write(''.join(self.chunk))
+        self.chunk = []
+        self.size = 0
+
+
+class RecordWriter:
+    """Packs uses and errors into binary records, read_records turns them back into tuples."""
+
+    def __init__(self, sink: BinaryIO, chunk_size=64 * 1024):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.chunk = bytearray()
+
+    def write(self, line_number: int, def_line_number: int, idn: str):
+        name = idn.encode()
+        self.chunk += RECORD.pack(line_number, def_line_number, len(name))
+        self.chunk += name
+
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def error(self, error: SemanticError):
+        self.write(error.line, 0, error.idn)
+
+    def flush(self):
+        self.sink.write(self.chunk)
+        self.chunk = bytearray()
 
-    def run(self):
-        loop = 0
 
-        i = 1
-        while i < len(self.lines):
-            line = self.lines[i]
-            line_type = self.get_type(line)
+def read_records(data: bytes) -> Iterator[Tuple[int, int, str]]:
+    """What RecordWriter wrote as (line, def_line, idn), def_line is 0 for an undefined use."""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        line_number, def_line_number, length = RECORD.unpack_from(view, offset)
+        offset += RECORD.size
+        yield line_number, def_line_number, bytes(view[offset:offset + length]).decode()
+        offset += length
+
+
+class SymbolTable:
+    """Nested scopes where every name keeps a stack of its bindings, so declare, get and pop are O(1).
+
+    Names resolve the way this lab always has, to the outermost loop that declares them and
+    only then to the global scope, unlike the code generator which takes the innermost binding.
+    """
+
+    def __init__(self):
+        self.bindings: dict[str, list] = {}
+        self.scopes: List[List[str]] = [[]]
+
+    def push(self):
+        self.scopes.append([])
+
+    def pop(self):
+        for name in self.scopes.pop():
+            bindings = self.bindings[name]
+            bindings.pop()
+            if not bindings:
+                del self.bindings[name]
+
+    def declare(self, name: str, value):
+        depth = len(self.scopes) - 1
+        bindings = self.bindings.setdefault(name, [])
+        if bindings and bindings[-1][0] == depth:
+            bindings[-1] = (depth, value)
+            return
+
+        bindings.append((depth, value))
+        self.scopes[-1].append(name)
+
+    def get(self, name: str):
+        bindings = self.bindings[name]
+        if bindings[0][0] == 0 and len(bindings) > 1:
+            return bindings[1][1]
+        return bindings[0][1]
+
+    def declared(self, name: str) -> bool:
+        """Whether the name is global or declared in the innermost scope, assigning anything else declares it."""
+        bindings = self.bindings.get(name)
+        return bindings is not None and (bindings[0][0] == 0 or bindings[-1][0] == len(self.scopes) - 1)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.bindings
+
+
+class SemanticAnalyzer:
+    """Checks uses against declarations in one pass over the tokens, looking one token ahead.
+
+    The tokens are consumed as they come, so an analyzer runs once. By default the first undefined
+    use raises SemanticError, with all_errors every one of them is collected in errors and the
+    analysis goes on.
+    """
+
+    def __init__(self, input: Union[str, os.PathLike, BinaryIO, Iterable[tuple]], all_errors: bool = False):
+        if isinstance(input, str):
+            self.tokens = (self.parse_line(line)
+                           for line in input.splitlines()[1:] if self.is_token(line))
+        elif isinstance(input, os.PathLike) or hasattr(input, 'read'):
+            self.tokens = (self.parse_line(line)
+                           for line in islice(read_lines(input), 1, None) if self.is_token(line))
+        elif hasattr(input, 'leaves'):
+            self.tokens = input.leaves()
+        else:
+            self.tokens = iter(input)
+
+        self.symbols = SymbolTable()
+        self.all_errors = all_errors
+        self.errors: List[SemanticError] = []
+
+    def run(self, writer: Union[TextWriter, RecordWriter, None] = None):
+        writer = writer or TextWriter(sys.stdout)
+
+        # errors are written where they happened, between the uses around them
+        written = 0
+        try:
+            for line_number, def_line_number, idn in self.analyze():
+                for error in self.errors[written:]:
+                    writer.error(error)
+                written = len(self.errors)
+                writer.write(line_number, def_line_number, idn)
+        except SemanticError as e:
+            writer.error(e)
+        finally:
+            for error in self.errors[written:]:
+                writer.error(error)
+            writer.flush()
+
+    def analyze(self) -> Iterator[Tuple[int, int, str]]:
+        token = next(self.tokens, None)
+        while token is not None:
+            following = next(self.tokens, None)
+            line_type, line_number, idn = token
+            token = following
 
             if line_type == 'KR_ZA':
-                loop += 1
-                self.scope_vars.append({})
+                self.symbols.push()
             elif line_type == 'KR_AZ':
-                loop -= 1
-                self.scope_vars.pop()
+                self.symbols.pop()
             elif line_type == 'IDN':
-                idn = self.get_identifier(line)
-                line_number = self.get_line(line)
-                next_line_type = self.get_type(self.lines[i + 1])
+                next_line_type = following[0] if following is not None else None
 
                 if next_line_type == 'OP_PRIDRUZI':
-                    if loop == 0 and idn not in self.global_vars:
-                        self.global_vars[idn] = line_number
-                    if loop > 0 and idn not in self.global_vars and idn not in self.scope_vars[-1]:
-                        self.scope_vars[-1][idn] = line_number
-
-                    i += 1
+                    if not self.symbols.declared(idn):
+                        self.symbols.declare(idn, line_number)
                     continue
 
                 if next_line_type == 'KR_OD':
-                    self.scope_vars[-1][idn] = line_number
-                    i += 1
+                    self.symbols.declare(idn, line_number)
                     continue
 
-                def_line_number = self.is_local(idn)
-                if def_line_number is None:
-                    def_line_number = self.global_vars.get(idn)
+                def_line_number = self.symbols.get(idn) if idn in self.symbols else None
 
                 if def_line_number == line_number:
                     def_line_number = None
 
                 if def_line_number is None:
-                    print('err', line_number, idn)
-                    break
-
-                print(line_number, def_line_number, idn)
-
-            i += 1
+                    if not self.all_errors:
+                        raise SemanticError(line_number, idn)
 
-    def is_local(self, idn: str):
-        for scope in self.scope_vars:
-            if idn in scope:
-                return scope[idn]
-
-    def get_line(self, line: str):
-        return int(line.strip().split(' ')[1])
+                    self.errors.append(SemanticError(line_number, idn))
+                    continue
 
-    def get_type(self, line: str):
-        return line.strip().split(' ')[0]
+                yield line_number, def_line_number, idn
 
-    def get_identifier(self, line: str):
-        if self.get_type(line) != 'IDN':
-            raise Exception('Not an identifier')
+    @staticmethod
+    def is_token(line: str) -> bool:
+        return len(line.split()) == 3
 
-        return line.strip().split(' ')[2]
+    @staticmethod
+    def parse_line(line: str) -> Tuple[str, int, str]:
+        line_type, line_number, idn = line.split()
+        return line_type, int(line_number), idn
 
 
 if __name__ == '__main__':
-    SemanticAnalyzer(sys.stdin.read()).run()
+    # --all reports every undefined use instead of stopping at the first one,
+    # --binary writes records instead of text
+    analyzer = SemanticAnalyzer(sys.stdin.buffer, all_errors='--all' in sys.argv[1:])
+    analyzer.run(RecordWriter(sys.stdout.buffer) if '--binary' in sys.argv[1:] else None)
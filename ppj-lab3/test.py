@@ -10,42 +10,56 @@ def load_file(filename):
         return f.read()
 
 
-def load_test(test):
-    input_string = load_file(os.path.join('./tests', test, 'test.in'))
-    expected_output = load_file(os.path.join('./tests', test, 'test.out'))
+def test_file(test, name):
+    """Some tests name their files Test.* instead of test.*."""
+    for found in os.listdir(os.path.join('./tests', test)):
+        if found.lower() == name:
+            return os.path.join('./tests', test, found)
+
+    return os.path.join('./tests', test, name)
+
+
+def load_test(test, expected='test.out'):
+    input_string = load_file(test_file(test, 'test.in'))
+    expected_output = load_file(test_file(test, expected))
 
     return input_string, expected_output
 
 
-class MyStringIO(StringIO):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.output = ''
+def cases(tests):
+    """Every test runs on test.out, the ones with a test.all again with all_errors on that."""
+    for test in tests:
+        yield test, 'test.out', False
+        if os.path.exists(test_file(test, 'test.all')):
+            yield test, 'test.all', True
+
 
-    def write(self, s):
-        self.output += s
+class MyStringIO(StringIO):
+    @property
+    def output(self):
+        return self.getvalue()
 
 
 if __name__ == '__main__':
-    tests = sorted(os.listdir('./tests'))
-    # tests = ['15_gen']
+    tests = list(cases(sorted(os.listdir('./tests'))))
+    # tests = [('15_gen', 'test.out', False)]
     score = 0
 
-    for test in tests:
-        input_string, expected_output = load_test(test)
+    for test, expected, all_errors in tests:
+        input_string, expected_output = load_test(test, expected)
 
         io = MyStringIO()
         try:
             with redirect_stdout(io):
-                SemanticAnalyzer(input_string).run()
+                SemanticAnalyzer(input_string, all_errors=all_errors).run()
         except Exception as e:
-            print(f"Run: ./tests/{test}/test.out failed")
+            print(f"Run: ./tests/{test}/{expected} failed")
             continue
 
         if io.output == expected_output:
             score += 1
         else:
-            out = f'./tests/{test}/test.out'
+            out = f'./tests/{test}/{expected}'
             actual = f'./tests/{test}/test.actual'
 
             msg = f"Test: {out} failed, output was {actual}"
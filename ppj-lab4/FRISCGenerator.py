@@ -1,11 +1,14 @@
-import re
+import mmap
+import os
+import stat
 import sys
 import pprint
-from typing import Literal, Optional, List
+from itertools import chain, islice
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Literal, NamedTuple, Optional, List, Tuple, Union
 from dataclasses import dataclass, field
 
 
-MULTIPLY_AND_DIVIDE_OPERATIONS = """
+SIGN_OPERATIONS = """
 MD_SGN MOVE 0, R6 ;--
     XOR R0, 0, R0
     JP_P MD_TST1
@@ -35,7 +38,10 @@ MD_RET1 POP R4 ; MD_RET ret addr ;--
     PUSH R3 ; M/D ret addr
     PUSH R4 ; MD_RET ret addr
     RET
-MUL CALL MD_INIT ;--
+"""
+
+# MUL adds op1 op2 times and DIV subtracts until the dividend goes negative
+LINEAR_MULTIPLY_AND_DIVIDE = """MUL CALL MD_INIT ;--
     XOR R1, 0, R1
     JP_Z MUL_RET ; op2 == 0
     SUB R1, 1, R1
@@ -55,11 +61,103 @@ DIV_RET CALL MD_RET ;--
     RET
 """
 
+# shift-and-add multiplication and restoring long division, at most 32 steps each,
+# R4 is free between MD_INIT and MD_RET and holds the remainder
+SHIFT_MULTIPLY_AND_DIVIDE = """MUL CALL MD_INIT ;--
+    XOR R1, 0, R1
+    JP_Z MUL_RET ; op2 == 0
+MUL_1 SHR R1, 1, R1 ; najnizi bit op2 u C ;--
+    JP_NC MUL_2
+    ADD R2, R0, R2
+MUL_2 SHL R0, 1, R0 ;--
+    XOR R1, 0, R1
+    JP_NZ MUL_1
+MUL_RET CALL MD_RET ;--
+    RET
+DIV CALL MD_INIT ;--
+    XOR R1, 0, R1
+    JP_Z DIV_RET ; op2 == 0
+    MOVE 0, R4 ; ostatak
+    MOVE %D 32, R2 ; brojac
+DIV_1 SHL R0, 1, R0 ; najvisi bit djeljenika u C ;--
+    ADC R4, R4, R4
+    CMP R4, R1
+    JP_ULT DIV_2
+    SUB R4, R1, R4
+    OR R0, 1, R0 ; bit kvocijenta
+DIV_2 SUB R2, 1, R2 ;--
+    JP_NZ DIV_1
+    MOVE R0, R2
+DIV_RET CALL MD_RET ;--
+    RET
+"""
+
+MULTIPLY_AND_DIVIDE_OPERATIONS = SIGN_OPERATIONS + LINEAR_MULTIPLY_AND_DIVIDE
+
+RUNTIMES = {
+    'linear': MULTIPLY_AND_DIVIDE_OPERATIONS,
+    'shift': SIGN_OPERATIONS + SHIFT_MULTIPLY_AND_DIVIDE,
+}
+
+
+# MOVE and ALU immediates are sign extended from their lower 20 bits
+MOVE_IMMEDIATE = range(-2 ** 19, 2 ** 19)
+
+# hoisted loop bounds are bound to a keyword, so they can never clash with a variable
+LOOP_BOUND = 'do'
+
 
 class IllegalStateError(Exception):
     pass
 
 
+def to_word(value: int) -> int:
+    """Wraps value to a signed 32 bit FRISC word."""
+    return (value + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+def power_of_two(value: Optional[int]) -> Optional[int]:
+    if value is None or value <= 0 or value & (value - 1):
+        return None
+
+    return value.bit_length() - 1
+
+
+def shift_asm(op: str, shift: int, target: str, scratch: str) -> List[str]:
+    """Multiplies or divides target by 2**shift, division truncates towards zero like the DIV runtime."""
+    if shift == 0:
+        return []
+
+    if op == 'OP_PUTA':
+        return [f"SHL {target}, %D {shift}, {target}"]
+
+    # negative dividends are biased by 2**shift - 1 so the arithmetic shift rounds towards zero
+    return [
+        f"ASHR {target}, %D 31, {scratch}",
+        f"SHR {scratch}, %D {32 - shift}, {scratch}",
+        f"ADD {target}, {scratch}, {target}",
+        f"ASHR {target}, %D {shift}, {target}",
+    ]
+
+
+def evaluate(op: str, left: int, right: int) -> int:
+    """Computes op the way the generated code does, DIV follows the MD_SGN/MD_RET runtime."""
+    if op == 'OP_PLUS':
+        return to_word(left + right)
+    elif op == 'OP_MINUS':
+        return to_word(left - right)
+    elif op == 'OP_PUTA':
+        return to_word(left * right)
+    elif op == 'OP_DIJELI':
+        if right == 0:
+            return 0
+
+        quotient = abs(left) // abs(right)
+        return to_word(-quotient if (left < 0) != (right < 0) else quotient)
+    else:
+        raise NotImplementedError
+
+
 class ScopeStore:
     def __init__(self) -> None:
         self.variables = {}
@@ -72,179 +170,298 @@ class ScopeStore:
         ]
 
 
-class GlobalStore:
+class SymbolTable:
+    """Nested scopes where every name keeps a stack of its bindings, so declare, get and pop are O(1)."""
+
     def __init__(self):
+        self.bindings: dict[str, list] = {}
+        self.scopes: List[List[str]] = [[]]
+
+    def push(self):
+        self.scopes.append([])
+
+    def pop(self):
+        for name in self.scopes.pop():
+            bindings = self.bindings[name]
+            bindings.pop()
+            if not bindings:
+                del self.bindings[name]
+
+    def declare(self, name: str, value):
+        depth = len(self.scopes) - 1
+        bindings = self.bindings.setdefault(name, [])
+        if bindings and bindings[-1][0] == depth:
+            bindings[-1] = (depth, value)
+            return
+
+        bindings.append((depth, value))
+        self.scopes[-1].append(name)
+
+    def get(self, name: str):
+        return self.bindings[name][-1][1]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.bindings
+
+
+@dataclass(frozen=True)
+class Options:
+    fold_constants: bool = True
+    allocate_registers: bool = True
+    runtime: Literal["shift", "linear"] = "shift"
+    hoist_loop_bounds: bool = True
+    peephole: bool = True
+    eliminate_dead_stores: bool = True
+
+
+class CompilationContext:
+    """State of a single compilation, threaded through every to_asm call."""
+
+    def __init__(self, options: Optional[Options] = None):
+        self.options = options or Options()
+        self.symbols = SymbolTable()
+        self.scope: List[str] = []
         self.has_multiply_or_divide = False
-        self.store = ScopeStore()
-        self.store.variables = {'rez': 'GLOBAL_RESULT'}
 
-    def add(self, name: str, path: List[str], idn: str):
-        if len(path) == 0:
-            self.store.variables[name] = idn
-            return
-        pointer = self.store
-        for scope in path:
-            if scope not in pointer.scopes:
-                pointer.scopes[scope] = ScopeStore()
-            pointer = pointer.scopes[scope]
+        # data words are laid out per scope, in the order the scopes were opened
+        self.layout = ScopeStore()
+        self.stores = [self.layout]
+        # labels the emitted code refers to, declared variables outside it need no data word
+        self.referenced = set()
+        self.labels = 0
+        # keeps the labels of separately generated fragments apart
+        self.namespace = ''
 
-        pointer.variables[name] = idn
+        self.add('rez', 'GLOBAL_RESULT')
 
-    def exists(self, name: str, path: List[str] = []):
-        try:
-            self.get(name, path)
-            return True
-        except KeyError:
-            return False
+    def push_scope(self, name: str):
+        self.scope.append(name)
+        self.symbols.push()
 
-    def get(self, name: str, path: List[str] = []):
-        if len(path) == 0:
-            return self.store.variables[name]
+        store = ScopeStore()
+        self.stores[-1].scopes[name] = store
+        self.stores.append(store)
 
-        for s in range(len(path), -1, -1):
-            pointer = self.store
-            for scope in path[:s]:
-                if scope not in pointer.scopes:
-                    break
+    def pop_scope(self):
+        self.scope.pop()
+        self.symbols.pop()
+        self.stores.pop()
 
-                pointer = pointer.scopes[scope]
+    def add(self, name: str, idn: str):
+        self.symbols.declare(name, idn)
+        self.stores[-1].variables[name] = idn
 
-            if name in pointer.variables:
-                return pointer.variables[name]
+    def exists(self, name: str) -> bool:
+        return name in self.symbols
 
-        raise KeyError(f"Variable {name} not found in scope {path}")
+    def get(self, name: str) -> str:
+        try:
+            label = self.symbols.get(name)
+        except KeyError:
+            raise KeyError(f"Variable {name} not found in scope {self.scope}") from None
 
-    def list(self):
-        return self.store.list()
+        self.referenced.add(label)
+        return label
 
+    def list(self) -> List[str]:
+        return self.layout.list()
 
-store = GlobalStore()
+    def unique(self, name: str) -> str:
+        """Labels numbered in the order they are generated, so the same program always gets the same code."""
+        self.labels += 1
+        return f"{name}_{self.namespace}{self.labels}"
 
 
 class Instruction:
+    __slots__ = ()
+
     def __init__(self):
         raise NotImplementedError
 
-    def to_asm(self, scope: List[str]) -> str:
+    def to_asm(self, ctx: CompilationContext) -> str:
+        raise NotImplementedError
+
+    def fold(self):
+        """Replaces constant subexpressions in place."""
         raise NotImplementedError
 
 
-@dataclass
+@dataclass(slots=True)
 class InstructionBlock:
     instruction: Instruction  # todo make this flatter
     block: Optional["InstructionBlock"]
     type: Literal["raw", "flattened"] = field(default="raw")
 
     @staticmethod
-    def parse(lines: List["Line"]) -> Optional["InstructionBlock"]:
-        sub = Line.get_subtree(lines[0:])
-        if len(sub) == 1:
-            if sub[0].type() == 'non':
-                return None
+    def from_node(node) -> Optional["InstructionBlock"]:
+        operations = []
+        while len(node.children) != 1:
+            instruction, node = node.children
+            operations.append(Operation.from_node(instruction.children[0]))
 
+        if node.children[0] != '$':
             raise IllegalStateError
 
-        raw_instruction = Line.get_subtree(sub[0:])
-        raw_instruction_block = sub[len(raw_instruction) + 1:]
+        block = None
+        for operation in reversed(operations):
+            block = InstructionBlock(operation, block, type="raw")
 
-        return InstructionBlock(
-            Operation.parse(raw_instruction),
-            InstructionBlock.parse(raw_instruction_block),
-            type="raw"
-        )
+        return block
 
     def instructions(self) -> List[Instruction]:
-        if self.block is None:
-            return [self.instruction]
+        instructions = []
+        block: Optional[InstructionBlock] = self
+        while block is not None:
+            instructions.append(block.instruction)
+            block = block.block
+
+        return instructions
+
+
+class Token(NamedTuple):
+    klass: str
+    line: int
+    lexeme: str
 
-        return [self.instruction] + self.block.instructions()
+
+class Node:
+    __slots__ = ('label', 'children')
+
+    def __init__(self, label: str):
+        self.label = label
+        self.children: List[Union["Node", Token, str]] = []
+
+    @staticmethod
+    def parse(lines: Iterable["Line"]) -> "Node":
+        """Builds the tree in one pass, keeping the open tags on an indent stack."""
+        lines = iter(lines)
+        first = next(lines)
+        root = Node(first.value)
+        stack = [(first.indent, root)]
+
+        for line in lines:
+            while len(stack) > 1 and stack[-1][0] >= line.indent:
+                stack.pop()
+
+            if line.kind == 'tag':
+                node = Node(line.value)
+                stack[-1][1].children.append(node)
+                stack.append((line.indent, node))
+            elif line.kind == 'non':
+                stack[-1][1].children.append('$')
+            else:
+                stack[-1][1].children.append(
+                    Token(line.klass, line.line, line.lexeme))
+
+        return root
 
 
 class Line:
-    value: str
-    indent: int
+    __slots__ = ('value', 'indent', 'kind', 'klass', 'line', 'lexeme')
 
-    def __init__(self, line):
+    def __init__(self, line: str):
         self.value = line.strip()
         self.indent = len(line) - len(self.value)
+        self.kind = Line.classify(self.value)
 
-    def type(self):
-        if re.match(r"^<.*>$", self.value):
+        parts = self.value.split(' ')
+        if len(parts) == 3:
+            self.klass, line_number, self.lexeme = parts
+            self.line = int(line_number)
+        else:
+            self.klass, self.line, self.lexeme = self.value, 0, ''
+
+    @staticmethod
+    def classify(value: str) -> str:
+        if value.startswith('<') and value.endswith('>'):
             return "tag"
-        elif self.value.startswith('IDN'):
+        elif value.startswith('IDN'):
             return "idn"
-        elif self.value.startswith('OP_'):
+        elif value.startswith('OP_'):
             return "ope"
-        elif self.value.startswith('BROJ'):
+        elif value.startswith('BROJ'):
             return "num"
-        elif self.value.startswith('KR_'):
+        elif value.startswith('KR_'):
             return 'for'
-        elif self.value == '$':
+        elif value == '$':
             return 'non'
 
         return "__unknown__"
 
-    def get_part(self, index: int):
-        return self.value.split(' ')[index]
+    def type(self):
+        return self.kind
 
     def __str__(self) -> str:
         return f"[{self.indent:2}][{self.type()}] {self.value}"
 
-    @staticmethod
-    def get_subtree(lines: List["Line"]) -> List["Line"]:
-        first_index = lines[0].indent
-        arr = []
-        for line in lines[1:]:
-            if line.indent <= first_index:
-                break
-            arr.append(line)
-
-        return arr
-
 
-@dataclass
+@dataclass(slots=True)
 class Primary:
     value: str
     type: Literal["idn", "num"]
     prefix: str = field(default="")
 
-    def to_asm(self, scope: List[str]) -> List[str]:
+    def to_asm(self, ctx: CompilationContext) -> List[str]:
         if self.type == "idn":
-            return [f"LOAD R0, ({store.get(self.value, scope)})"]
+            return [f"LOAD R0, ({ctx.get(self.value)})"]
 
         return [f"MOVE %D {self.prefix}{self.value}, R0"]
 
+    def constant(self) -> Optional[int]:
+        if self.type == "idn":
+            return None
+
+        return to_word(int(f"{self.prefix}{self.value}"))
+
+    def immediate(self) -> Optional[int]:
+        if self.type == "idn":
+            return None
+
+        value = int(f"{self.prefix}{self.value}")
+        return value if value in MOVE_IMMEDIATE else None
+
+    @staticmethod
+    def of(value: int) -> "Primary":
+        return Primary(str(value), "num")
+
     @staticmethod
-    def parse(lines: List[Line]) -> "Primary":
-        if len(lines) != 1:
-            tmp = Primary.parse(lines[2:])
-            tmp.prefix = lines[0].get_part(2)
-            return tmp
+    def from_node(node) -> "Primary":
+        prefix = ""
+        while len(node.children) == 2 and getattr(node.children[1], 'label', None) == '<P>':
+            prefix = prefix or node.children[0].lexeme
+            node = node.children[1]
 
-        p_type = lines[0].type()
-        if p_type not in ["idn", "num"]:
-            raise IllegalStateError(f"Invalid primary type: {p_type}")
+        token = node.children[0]
+        if len(node.children) != 1 or token.klass not in ["IDN", "BROJ"]:
+            raise IllegalStateError(f"Invalid primary type: {token.klass}")
 
-        return Primary(lines[0].get_part(2), p_type)  # type: ignore
+        return Primary(token.lexeme, "idn" if token.klass == "IDN" else "num", prefix)
 
 
-@ dataclass
+@ dataclass(slots=True)
 class TermList:
     op: str
     term: "Term"
 
-    def to_asm(self, scope: List[str]) -> List[str]:
+    def to_asm(self, ctx: CompilationContext) -> List[str]:
+        shift = power_of_two(self.term.constant())
+        if shift is not None:
+            return [
+                *shift_asm(self.op, shift, 'R0', 'R1'),
+                'PUSH R0',
+            ]
+
         return [
             'PUSH R0',
-            *self.term.to_asm(scope),
-            *self.get_op(),
+            *self.term.to_asm(ctx),
+            *self.get_op(ctx),
         ]
 
-    def get_op(self) -> List[str]:
+    def get_op(self, ctx: CompilationContext) -> List[str]:
         pops = []
 
         if self.op in ['OP_PUTA', 'OP_DIJELI']:
-            store.has_multiply_or_divide = True
+            ctx.has_multiply_or_divide = True
 
         if self.op == "OP_PUTA":
             return [*pops, "CALL MUL"]
@@ -253,52 +470,92 @@ class TermList:
         else:
             raise NotImplementedError
 
-    @staticmethod
-    def parse(lines: List[Line]) -> Optional["TermList"]:
-        items = Line.get_subtree(lines[0:])
-
-        return TermList(
-            items[0].get_part(0),
-            Term.parse(items[2:])
-        )
-
 
-@ dataclass
+@ dataclass(slots=True)
 class Term:
     primary: "Primary"
     t_list: Optional[TermList]
 
-    def to_asm(self, scope: List[str]) -> List[str]:
+    def to_asm(self, ctx: CompilationContext) -> List[str]:
         if self.t_list is None:
             return [
-                *self.primary.to_asm(scope),
+                *self.primary.to_asm(ctx),
                 f"PUSH R0"
             ]
 
         return [
-            *self.primary.to_asm(scope),
-            *self.t_list.to_asm(scope)
+            *self.primary.to_asm(ctx),
+            *self.t_list.to_asm(ctx)
         ]
 
+    def constant(self) -> Optional[int]:
+        return self.primary.constant() if self.t_list is None else None
+
+    def fold(self) -> "Term":
+        """Folds constant products and quotients right to left, the way the chain associates."""
+        primaries = []
+        ops = []
+        term: Optional[Term] = self
+        while term is not None:
+            primaries.append(term.primary)
+            if term.t_list is None:
+                break
+
+            ops.append(term.t_list.op)
+            term = term.t_list.term
+
+        term = Term(primaries.pop(), None)
+        for primary, op in zip(reversed(primaries), reversed(ops)):
+            term = Term.combine(primary, op, term)
+
+        return term
+
     @staticmethod
-    def parse(lines: List[Line]) -> "Term":
-        term = Line.get_subtree(lines[0:])
-        rest = lines[len(term) + 1:]
+    def combine(primary: Primary, op: str, term: "Term") -> "Term":
+        left, right = primary.constant(), term.constant()
+        if left is not None and right is not None:
+            value = evaluate(op, left, right)
+            if value in MOVE_IMMEDIATE:
+                return Term(Primary.of(value), None)
+
+        # reading a variable has no side effects, so x * 0 can drop x entirely
+        if left == 0 or right == 0:
+            return Term(Primary.of(0), None)
+        if right == 1:
+            return Term(primary, None)
+        if left == 1 and op == 'OP_PUTA':
+            return term
+
+        return Term(primary, TermList(op, term))
+
+    @staticmethod
+    def from_node(node) -> "Term":
+        primaries = []
+        ops = []
+        while True:
+            primary, t_list = node.children
+            primaries.append(Primary.from_node(primary))
+            if len(t_list.children) == 1:
+                break
+
+            op, node = t_list.children
+            ops.append(op.klass)
 
-        return Term(
-            Primary.parse(term),
-            TermList.parse(rest) if len(rest) > 2 else None
-        )
+        term = Term(primaries.pop(), None)
+        for primary, op in zip(reversed(primaries), reversed(ops)):
+            term = Term(primary, TermList(op, term))
 
+        return term
 
-@ dataclass
+
+@ dataclass(slots=True)
 class ExpressionList:
     op: str
     expression: "Expression"
 
-    def to_asm(self, scope: List[str]) -> List[str]:
+    def to_asm(self, ctx: CompilationContext) -> List[str]:
         return [
-            *self.expression.to_asm(scope),
+            *self.expression.to_asm(ctx),
             *self.get_op(),
             "PUSH R2",
         ]
@@ -312,44 +569,241 @@ class ExpressionList:
         else:
             raise NotImplementedError
 
-    @staticmethod
-    def parse(lines: List[Line]) -> Optional["ExpressionList"]:
-        items = Line.get_subtree(lines[0:])
-
-        return ExpressionList(
-            items[0].get_part(0),
-            Expression.parse(items[1:])
-        )
-
 
-@ dataclass
+@ dataclass(slots=True)
 class Expression:
     term: Term
     e_list: Optional[ExpressionList]
 
-    def to_asm(self, scope: List[str]) -> List[str]:
+    def to_asm(self, ctx: CompilationContext) -> List[str]:
         if self.e_list is None:
-            return self.term.to_asm(scope)
+            return self.term.to_asm(ctx)
 
         return [
-            *self.term.to_asm(scope),
-            *self.e_list.to_asm(scope),
+            *self.term.to_asm(ctx),
+            *self.e_list.to_asm(ctx),
         ]
 
+    def constant(self) -> Optional[int]:
+        return self.term.constant() if self.e_list is None else None
+
+    def primary(self) -> Optional[Primary]:
+        if self.e_list is None and self.term.t_list is None:
+            return self.term.primary
+
+        return None
+
+    def names(self) -> set:
+        """Variables read by the expression."""
+        names = set()
+        expression: Optional[Expression] = self
+        while expression is not None:
+            term: Optional[Term] = expression.term
+            while term is not None:
+                if term.primary.type == "idn":
+                    names.add(term.primary.value)
+                term = term.t_list.term if term.t_list is not None else None
+
+            expression = expression.e_list.expression if expression.e_list is not None else None
+
+        return names
+
+    def fold(self) -> "Expression":
+        """Folds every term, then constant sums and differences right to left."""
+        terms = []
+        ops = []
+        expression: Optional[Expression] = self
+        while expression is not None:
+            terms.append(expression.term.fold())
+            if expression.e_list is None:
+                break
+
+            ops.append(expression.e_list.op)
+            expression = expression.e_list.expression
+
+        expression = Expression(terms.pop(), None)
+        for term, op in zip(reversed(terms), reversed(ops)):
+            expression = Expression.combine(term, op, expression)
+
+        return expression
+
+    @staticmethod
+    def combine(term: Term, op: str, expression: "Expression") -> "Expression":
+        left, right = term.constant(), expression.constant()
+        if left is not None and right is not None:
+            value = evaluate(op, left, right)
+            if value in MOVE_IMMEDIATE:
+                return Expression(Term(Primary.of(value), None), None)
+
+        if right == 0:
+            return Expression(term, None)
+        if left == 0 and op == 'OP_PLUS':
+            return expression
+
+        return Expression(term, ExpressionList(op, expression))
+
     @staticmethod
-    def parse(lines: List[Line]) -> "Expression":
-        t_section = Line.get_subtree(lines[1:])
-        t = Term.parse(t_section)
+    def from_node(node) -> "Expression":
+        terms = []
+        ops = []
+        while True:
+            term, e_list = node.children
+            terms.append(Term.from_node(term))
+            if len(e_list.children) == 1:
+                break
+
+            op, node = e_list.children
+            ops.append(op.klass)
+
+        expression = Expression(terms.pop(), None)
+        for term, op in zip(reversed(terms), reversed(ops)):
+            expression = Expression(term, ExpressionList(op, expression))
+
+        return expression
+
+
+class Operand(NamedTuple):
+    op: Optional[str]
+    left: Union["Operand", Primary]
+    right: Optional["Operand"]
+    need: int
+
+    @property
+    def immediate(self) -> Optional[int]:
+        return self.left.immediate() if self.op is None else None
+
+    @property
+    def constant(self) -> Optional[int]:
+        return self.left.constant() if self.op is None else None
+
+
+class RegisterAllocator:
+    """Sethi-Ullman code generation, keeps intermediate values in R0-R5 and spills only when they run out."""
+
+    REGISTERS = ('R0', 'R1', 'R2', 'R3', 'R4', 'R5')
+    # MUL and DIV clobber R0-R4, needing more registers than there are makes sure nothing else is live around the call
+    CALL = len(REGISTERS) + 1
+
+    def __init__(self, ctx: CompilationContext):
+        self.ctx = ctx
+
+    def to_asm(self, expression: Expression, registers=REGISTERS) -> List[str]:
+        """Evaluates expression into registers[0]."""
+        return self.emit(self.label(expression), registers)
+
+    def label(self, expression: Expression) -> Operand:
+        terms = []
+        ops = []
+        while True:
+            terms.append(self.label_term(expression.term))
+            if expression.e_list is None:
+                break
+
+            ops.append(expression.e_list.op)
+            expression = expression.e_list.expression
+
+        operand = terms.pop()
+        for term, op in zip(reversed(terms), reversed(ops)):
+            operand = self.binary(term, op, operand)
+
+        return operand
+
+    def label_term(self, term: Term) -> Operand:
+        primaries = []
+        ops = []
+        while True:
+            primaries.append(Operand(None, term.primary, None, 1))
+            if term.t_list is None:
+                break
+
+            ops.append(term.t_list.op)
+            term = term.t_list.term
+
+        operand = primaries.pop()
+        for primary, op in zip(reversed(primaries), reversed(ops)):
+            operand = self.binary(primary, op, operand)
+
+        return operand
+
+    def binary(self, left: Operand, op: str, right: Operand) -> Operand:
+        if op in ['OP_PUTA', 'OP_DIJELI']:
+            if op == 'OP_PUTA' and power_of_two(left.constant) is not None and power_of_two(right.constant) is None:
+                left, right = right, left
+
+            if power_of_two(right.constant) is not None:
+                # dividing by a shift needs a scratch register for the rounding bias
+                return Operand(op, left, right, max(left.need, 2) if op == 'OP_DIJELI' else left.need)
+
+            return Operand(op, left, right, self.CALL)
+
+        if op == 'OP_PLUS' and left.immediate is not None and right.immediate is None:
+            left, right = right, left
+
+        if right.immediate is not None:
+            return Operand(op, left, right, left.need)
+
+        need = max(left.need, right.need) if left.need != right.need else left.need + 1
+        return Operand(op, left, right, need)
 
-        e_list_index = len(t_section) + 1
-        rest = lines[e_list_index + 1:]
-        if len(rest) <= 2:
-            return Expression(t, None)
+    def emit(self, operand: Operand, registers) -> List[str]:
+        target = registers[0]
+        if operand.op is None:
+            primary = operand.left
+            if primary.type == "idn":
+                return [f"LOAD {target}, ({self.ctx.get(primary.value)})"]
 
-        return Expression(t, ExpressionList.parse(rest))
+            return [f"MOVE %D {primary.prefix}{primary.value}, {target}"]
+
+        left, right = operand.left, operand.right
+        shift = power_of_two(right.constant)
+        if operand.op in ['OP_PUTA', 'OP_DIJELI'] and shift is not None:
+            return [
+                *self.emit(left, registers),
+                *shift_asm(operand.op, shift, target, registers[1] if len(registers) > 1 else None),
+            ]
+
+        if operand.op in ['OP_PUTA', 'OP_DIJELI']:
+            self.ctx.has_multiply_or_divide = True
+            return [
+                *self.emit(left, registers),
+                f"PUSH {target}",
+                *self.emit(right, registers),
+                f"PUSH {target}",
+                "CALL MUL" if operand.op == 'OP_PUTA' else "CALL DIV",
+                f"POP {target}",
+            ]
+
+        alu = "ADD" if operand.op == 'OP_PLUS' else "SUB"
+        if right.immediate is not None:
+            return [
+                *self.emit(left, registers),
+                f"{alu} {target}, %D {right.immediate}, {target}",
+            ]
+
+        if left.need >= right.need and right.need < len(registers):
+            return [
+                *self.emit(left, registers),
+                *self.emit(right, registers[1:]),
+                f"{alu} {target}, {registers[1]}, {target}",
+            ]
+
+        if left.need < len(registers):
+            return [
+                *self.emit(right, registers),
+                *self.emit(left, registers[1:]),
+                f"{alu} {registers[1]}, {target}, {target}",
+            ]
+
+        return [
+            *self.emit(right, registers),
+            f"PUSH {target}",
+            *self.emit(left, registers),
+            f"POP {registers[1]}",
+            f"{alu} {target}, {registers[1]}, {target}",
+        ]
 
 
-@ dataclass
+@ dataclass(slots=True)
 class Operation(Instruction):
     idn: str
 
@@ -357,104 +811,564 @@ class Operation(Instruction):
         raise NotImplementedError
 
     @staticmethod
-    def parse(lines: List[Line]) -> "Operation":
-        if lines[0].value == '<naredba_pridruzivanja>':
-            assignment = Line.get_subtree(lines)
-            return AssignOperation(
-                assignment[0].get_part(2),
-                Expression.parse(assignment[2:])
+    def from_node(node) -> "Operation":
+        if node.label == '<naredba_pridruzivanja>':
+            idn, _, expression = node.children[:3]
+            return AssignOperation(idn.lexeme, Expression.from_node(expression), idn.line)
+        elif node.label == '<za_petlja>':
+            za, idn, _, range_from, _, range_to, block, az = node.children
+            return ForLoopOperation(
+                idn.lexeme,
+                Expression.from_node(range_from),
+                Expression.from_node(range_to),
+                InstructionBlock.from_node(block),
+                za.line,
+                az.line
             )
-        elif lines[0].value == '<za_petlja>':
-            inside = Line.get_subtree(lines)
-
-            from_i = -1
-            to_i = -1
-            for i, l in enumerate(inside):
-                if l.get_part(0) == 'KR_DO':
-                    from_i = i
-                elif l.get_part(0) == '<lista_naredbi>':
-                    to_i = i
-                    break
-
-            range_from = Expression.parse(inside[3:from_i])
-            range_to = Expression.parse(inside[from_i+1:to_i])
-            block = InstructionBlock.parse(lines[to_i+1:-1])
-
-            return ForLoopOperation(lines[2].get_part(2), range_from, range_to, block)
         else:
             raise NotImplementedError
 
 
-@ dataclass
+@ dataclass(slots=True)
 class AssignOperation(Operation):
+    NODE = '<naredba_pridruzivanja>'
+
     expression: Expression
+    line: int = 0
+
+    def to_asm(self, ctx: CompilationContext) -> List[str]:
+        if ctx.options.allocate_registers:
+            return [
+                *RegisterAllocator(ctx).to_asm(self.expression),
+                f"STORE R0, ({self.get_symbol(ctx)})"
+            ]
 
-    def to_asm(self, scope: List[str]) -> List[str]:
         if self.expression.e_list is None and self.expression.term.t_list is None:
             return [
-                *self.expression.term.primary.to_asm(scope),
-                f"STORE R0, ({self.get_symbol(scope)})"
+                *self.expression.term.primary.to_asm(ctx),
+                f"STORE R0, ({self.get_symbol(ctx)})"
             ]
 
-        calc_expression = self.expression.to_asm(scope)
+        calc_expression = self.expression.to_asm(ctx)
 
         return [
             *calc_expression,
             f"POP R0",
-            f"STORE R0, ({self.get_symbol(scope)})"
+            f"STORE R0, ({self.get_symbol(ctx)})"
         ]
 
-    def get_symbol(self, scope: List[str]) -> str:
-        return store.get(self.idn, scope)
+    def get_symbol(self, ctx: CompilationContext) -> str:
+        return ctx.get(self.idn)
+
+    def fold(self):
+        self.expression = self.expression.fold()
+
+
+@ dataclass(slots=True)
+class DeclareOperation(Operation):
+    """What is left of a dead assignment, the variable is still declared in the scope the assignment would put it."""
+
+    def to_asm(self, ctx: CompilationContext) -> List[str]:
+        return []
+
+    def fold(self):
+        pass
 
 
-@ dataclass
+@ dataclass(slots=True)
 class ForLoopOperation(Operation):
+    NODE = '<za_petlja>'
+
     range_from: Expression
     range_to: Expression
     block: Optional[InstructionBlock]
-
-    def __init__(self, idn: str, range_from: Expression, range_to: Expression, block: Optional[InstructionBlock]):
+    # lines of KR_ZA and KR_AZ, the condition is reported on the latter
+    line: int = 0
+    end_line: int = 0
+    uuid: str = field(init=False, repr=False)
+    iterator: "AssignOperation" = field(init=False, repr=False)
+
+    def __init__(self, idn: str, range_from: Expression, range_to: Expression, block: Optional[InstructionBlock],
+                 line: int = 0, end_line: int = 0):
         self.idn = idn
         self.range_from = range_from
         self.range_to = range_to
         self.block = block
+        self.line = line
+        self.end_line = end_line
 
         self.uuid = f"FOR_{self.idn}_{id(self)}"
-        self.iterator = AssignOperation(self.idn, self.range_from)
+        self.iterator = AssignOperation(self.idn, self.range_from, self.line)
+
+    def fold(self):
+        self.range_from = self.range_from.fold()
+        self.range_to = self.range_to.fold()
+        self.iterator = AssignOperation(self.idn, self.range_from, self.line)
+
+    def assigned(self) -> set:
+        """Variables the loop writes, its own iterator included."""
+        names = {self.idn}
+        blocks = [self.block] if self.block is not None else []
+        while blocks:
+            for instruction in blocks.pop().instructions():
+                names.add(instruction.idn)
+                if isinstance(instruction, ForLoopOperation) and instruction.block is not None:
+                    blocks.append(instruction.block)
+
+        return names
+
+    def is_invariant(self, ctx: CompilationContext) -> bool:
+        return ctx.options.hoist_loop_bounds and not self.range_to.names() & self.assigned()
+
+    def get_bound(self, ctx: CompilationContext) -> Tuple[List[str], str]:
+        """Code that loads an invariant bound and the CMP operand it leaves it in."""
+        primary = self.range_to.primary()
+        if primary is not None and primary.immediate() is not None:
+            return [], f"%D {primary.immediate()}"
+
+        if primary is not None and primary.type == "idn":
+            return [f"LOAD R1, ({ctx.get(primary.value)})"], "R1"
+
+        return [f"LOAD R1, ({ctx.get(LOOP_BOUND)})"], "R1"
+
+    def get_init(self, ctx: CompilationContext) -> List[str]:
+        hoisted = []
+        primary = self.range_to.primary()
+        if self.is_invariant(ctx) and (primary is None or primary.type == "num" and primary.immediate() is None):
+            ctx.add(LOOP_BOUND, f"{self.uuid}_do")
+            hoisted = AssignOperation(LOOP_BOUND, self.range_to).to_asm(ctx)
 
-    def get_init(self, scope: List[str]) -> List[str]:
         return [
-            *self.iterator.to_asm(scope),
+            *self.iterator.to_asm(ctx),
+            *hoisted,
             f"{self.uuid} ; FOR LOOP ;--"
         ]
 
-    def get_condition(self, scope: List[str]) -> List[str]:
+    def get_condition(self, ctx: CompilationContext) -> List[str]:
+        if self.is_invariant(ctx):
+            load, bound = self.get_bound(ctx)
+            return [
+                f'LOAD R0, ({self.iterator.get_symbol(ctx)})',
+                'ADD R0, 1, R0',
+                f'STORE R0, ({self.iterator.get_symbol(ctx)})',
+                *load,
+                f'CMP R0, {bound}',
+                f'JP_SLE {self.uuid}',
+            ]
+
+        if ctx.options.allocate_registers:
+            return [
+                f'LOAD R0, ({self.iterator.get_symbol(ctx)})',
+                'ADD R0, 1, R0',
+                f'STORE R0, ({self.iterator.get_symbol(ctx)})',
+
+                *RegisterAllocator(ctx).to_asm(self.range_to, RegisterAllocator.REGISTERS[1:]),
+
+                f'LOAD R0, ({self.iterator.get_symbol(ctx)})',
+                'CMP R0, R1',
+                f'JP_SLE {self.uuid}',
+            ]
+
         return [
-            f'LOAD R0, ({self.iterator.get_symbol(scope)})',
+            f'LOAD R0, ({self.iterator.get_symbol(ctx)})',
             'ADD R0, 1, R0',
-            f'STORE R0, ({self.iterator.get_symbol(scope)})',
+            f'STORE R0, ({self.iterator.get_symbol(ctx)})',
 
-            *self.range_to.to_asm(scope),
+            *self.range_to.to_asm(ctx),
 
-            f'LOAD R0, ({self.iterator.get_symbol(scope)})',
+            f'LOAD R0, ({self.iterator.get_symbol(ctx)})',
             'POP R1',
             'CMP R0, R1',
             f'JP_SLE {self.uuid}',
         ]
 
 
+class DeadStoreElimination:
+    """Strong liveness over the instruction tree, only rez is observable once the program halts.
+
+    Variables are tracked by name, a name that stands for different variables in different
+    scopes only keeps more stores alive. Every live name carries its reach, the depth of the
+    outermost loop its value matters to, a value only the condition of a loop reads matters to
+    the loops inside it and not to the loop itself. A loop whose body only matters to loops inside
+    it cannot affect anything live and is dropped.
+
+    Every loop keeps what is live at its condition, which only grows, and passes over the whole
+    program repeat until none of them does, so a pass visits every loop once.
+    """
+
+    # reach of a block where nothing is kept
+    NOWHERE = sys.maxsize
+
+    def __init__(self):
+        self.conditions: Dict[int, Dict[str, int]] = {}
+        self.changed = False
+
+    def run(self, root: InstructionBlock):
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            self.block(root, {'rez': 0}, apply=False, depth=0)
+
+        self.block(root, {'rez': 0}, apply=True, depth=0)
+
+    def block(self, block: Optional[InstructionBlock], live: Dict[str, int], apply: bool,
+              depth: int) -> Tuple[Dict[str, int], int]:
+        """Returns the names live before the block and the reach of the instructions it keeps."""
+        links = []
+        while block is not None:
+            links.append(block)
+            block = block.block
+
+        reach = self.NOWHERE
+        for link in reversed(links):
+            instruction = link.instruction
+            # loops are entered from here, a frame less per level keeps deep nests within the
+            # recursion limit InstructionBlock.from_node already has
+            if isinstance(instruction, AssignOperation):
+                live, kept = self.assign(link, live, apply)
+            elif isinstance(instruction, ForLoopOperation) and instruction.block is not None:
+                live, kept = self.loop(instruction, live, apply, depth)
+            else:
+                continue
+            reach = min(reach, kept)
+
+        return live, reach
+
+    def assign(self, link: InstructionBlock, live: Dict[str, int], apply: bool) -> Tuple[Dict[str, int], int]:
+        instruction = link.instruction
+        reach = live.get(instruction.idn)
+        if reach is None:
+            if apply:
+                link.instruction = DeclareOperation(instruction.idn)
+            return live, self.NOWHERE
+
+        live = dict(live)
+        del live[instruction.idn]
+        self.join(live, dict.fromkeys(instruction.expression.names(), reach))
+        return live, reach
+
+    def loop(self, loop: ForLoopOperation, live: Dict[str, int], apply: bool,
+             depth: int) -> Tuple[Dict[str, int], int]:
+        # the condition reads the iterator and the bound, the back edge feeds the start of the body into it
+        condition = self.conditions.setdefault(id(loop), {})
+        self.changed |= self.join(condition, live)
+        self.changed |= self.join(condition, dict.fromkeys({loop.idn} | loop.range_to.names(), depth + 1))
+
+        # once the conditions are stable, applying to a body that turns out irrelevant keeps nothing there
+        top, reach = self.block(loop.block, dict(condition), apply, depth + 1)
+        self.changed |= self.join(condition, top)
+
+        if reach > depth:
+            if apply:
+                loop.block = None
+            return live, self.NOWHERE
+
+        # whatever decides the trip count matters as far as the loop does, inside the loop its name
+        # is the iterator, outside it is whatever it was before
+        before = {name: min(value, reach) for name, value in top.items() if name != loop.idn}
+        start = min(top.get(loop.idn, reach), reach)
+        self.join(before, dict.fromkeys(loop.range_from.names() - {loop.idn}, start))
+        if loop.idn in live:
+            self.join(before, {loop.idn: live[loop.idn]})
+
+        return before, reach
+
+    @staticmethod
+    def join(live: Dict[str, int], other: Dict[str, int]) -> bool:
+        """Adds other to live keeping the smaller reach, returns whether live changed."""
+        changed = False
+        for name, reach in other.items():
+            if reach < live.get(name, DeadStoreElimination.NOWHERE):
+                live[name] = reach
+                changed = True
+
+        return changed
+
+
+class SourceOrigin(NamedTuple):
+    """Where a generated line comes from, line is 0 for the runtime and node then names its routine."""
+    line: int
+    node: str
+
+
+@dataclass(slots=True)
+class AsmLine:
+    """One line of generated code, ;-- marks lines that start with a label."""
+    label: str
+    op: str
+    operands: List[str]
+    comment: str = ""
+    origin: Optional[SourceOrigin] = None
+
+    @staticmethod
+    def of(op: str, *operands: str) -> "AsmLine":
+        return AsmLine("", op, list(operands))
+
+    @staticmethod
+    def parse(line: str, origin: Optional[SourceOrigin] = None) -> "AsmLine":
+        text = line.strip()
+        labelled = text.endswith(';--')
+        if labelled:
+            text = text[:-3]
+
+        code, _, comment = text.partition(';')
+        label = ""
+        if labelled:
+            label, _, code = code.strip().partition(' ')
+
+        op, _, operands = code.strip().partition(' ')
+        operands = [operand.strip() for operand in operands.split(',')] if operands else []
+        return AsmLine(label, op, operands, comment.strip(), origin)
+
+    def target(self) -> str:
+        """The register written by LOAD, POP, MOVE or an ALU instruction."""
+        return self.operands[0] if self.op in ['LOAD', 'POP'] else self.operands[-1]
+
+    def reads(self, register: str) -> bool:
+        if self.op == 'LOAD':
+            sources = self.operands[1:]
+        elif self.op in ['STORE', 'PUSH', 'CMP']:
+            sources = self.operands
+        else:
+            sources = self.operands[:-1]
+        return any(register in operand for operand in sources)
+
+    def render(self) -> str:
+        instruction = f"{self.op} {', '.join(self.operands)}" if self.operands else self.op
+        text = ' '.join(part for part in [self.label, instruction] if part)
+        if self.comment:
+            text = f"{text} ; {self.comment}" if text else f"; {self.comment}"
+
+        return f"{text} ;--" if self.label else text
+
+
+class PeepholeRule(NamedTuple):
+    name: str
+    size: int
+    apply: Callable[..., Optional[List[AsmLine]]]
+
+
+def push_pop(push: AsmLine, pop: AsmLine) -> Optional[List[AsmLine]]:
+    if push.op != 'PUSH' or pop.op != 'POP':
+        return None
+
+    if push.operands == pop.operands:
+        return []
+
+    return [AsmLine.of('MOVE', push.operands[0], pop.operands[0])]
+
+
+def store_load(store: AsmLine, load: AsmLine) -> Optional[List[AsmLine]]:
+    if store.op != 'STORE' or load.op != 'LOAD' or store.operands[1] != load.operands[1]:
+        return None
+
+    if store.operands[0] == load.operands[0]:
+        return [store]
+
+    return [store, AsmLine.of('MOVE', store.operands[0], load.operands[0])]
+
+
+def load_store(load: AsmLine, store: AsmLine) -> Optional[List[AsmLine]]:
+    if load.op == 'LOAD' and store.op == 'STORE' and load.operands == store.operands:
+        return [load]
+
+    return None
+
+
+def overwritten_load(first: AsmLine, second: AsmLine) -> Optional[List[AsmLine]]:
+    """LOAD and MOVE leave the flags alone, so one whose register is written before it is read can go."""
+    if first.op not in ['LOAD', 'MOVE'] or second.op not in ['LOAD', 'MOVE']:
+        return None
+
+    target = first.target()
+    if second.target() != target or second.reads(target):
+        return None
+
+    return [second]
+
+
+def self_move(move: AsmLine) -> Optional[List[AsmLine]]:
+    if move.op == 'MOVE' and len(move.operands) == 2 and move.operands[0] == move.operands[1]:
+        return []
+
+    return None
+
+
+PEEPHOLE_RULES = [
+    PeepholeRule('push_pop', 2, push_pop),
+    PeepholeRule('store_load', 2, store_load),
+    PeepholeRule('load_store', 2, load_store),
+    PeepholeRule('overwritten_load', 2, overwritten_load),
+    PeepholeRule('self_move', 1, self_move),
+]
+
+
+class Peephole:
+    """Rewrites short windows of adjacent instructions, counting how often every rule fired."""
+
+    def __init__(self, rules: Optional[List[PeepholeRule]] = None):
+        self.rules = PEEPHOLE_RULES if rules is None else rules
+        self.size = max((rule.size for rule in self.rules), default=0)
+        self.hits: Dict[str, int] = {rule.name: 0 for rule in self.rules}
+        # origins of the lines the last run returned, rewritten lines keep the origin of the window
+        self.origins: List[Optional[SourceOrigin]] = []
+
+    def run(self, lines: List[str], origins: Optional[List[Optional[SourceOrigin]]] = None) -> List[str]:
+        origins = origins or [None] * len(lines)
+        out: List[AsmLine] = []
+        for line, origin in zip(lines, origins):
+            out.append(AsmLine.parse(line, origin))
+            while self.rewrite(out):
+                pass
+
+        self.origins = [line.origin for line in out]
+        return [line.render() for line in out]
+
+    def window(self, out: List[AsmLine]) -> List[int]:
+        """Indices of the last instructions, comments are skipped and a label ends the window since jumps land there."""
+        window = []
+        for index in range(len(out) - 1, -1, -1):
+            line = out[index]
+            if line.op:
+                window.append(index)
+            if line.label or len(window) == self.size:
+                break
+
+        return window[::-1]
+
+    def rewrite(self, out: List[AsmLine]) -> bool:
+        if not out or not out[-1].op:
+            return False
+
+        window = self.window(out)
+        for rule in self.rules:
+            if len(window) < rule.size:
+                continue
+
+            indices = window[-rule.size:]
+            replacement = rule.apply(*(out[index] for index in indices))
+            if replacement is None:
+                continue
+
+            self.hits[rule.name] += 1
+            label = out[indices[0]].label
+            origin = out[indices[0]].origin
+            for index in reversed(indices):
+                del out[index]
+
+            for line in replacement:
+                if line.origin is None:
+                    line.origin = origin
+
+            if label:
+                replacement = replacement or [AsmLine("", "", [], origin=origin)]
+                first = replacement[0]
+                replacement[0] = AsmLine(label, first.op, first.operands, first.comment, first.origin)
+
+            out[indices[0]:indices[0]] = replacement
+            return True
+
+        return False
+
+
+PROLOGUE = [
+    '; Generated by FRISC generator',
+    'MOVE 40000, R7 ; stack pointer',
+    ''
+]
+
+
+def runtime_origins(runtime: str) -> List[Optional[SourceOrigin]]:
+    """Every runtime line maps to the routine whose label came last."""
+    origins = []
+    routine = None
+    for line in runtime.splitlines():
+        routine = AsmLine.parse(line).label or routine
+        origins.append(SourceOrigin(0, routine) if routine else None)
+
+    return origins
+
+
+def epilogue(ctx: CompilationContext, variables: List[str]) -> Tuple[List[str], List[Optional[SourceOrigin]]]:
+    """Everything after the statements, result to R6, HALT, data words and the runtime if it is needed."""
+    lines = ['', f'LOAD R6, ({ctx.get("rez")})', 'HALT', '', '; Global variables']
+    lines.extend(f"{var} DW 0 ;--" for var in variables)
+    origins: List[Optional[SourceOrigin]] = [None] * len(lines)
+
+    if ctx.has_multiply_or_divide:
+        runtime = RUNTIMES[ctx.options.runtime]
+        lines.extend(['', *runtime.splitlines()])
+        origins.extend([None, *runtime_origins(runtime)])
+
+    return lines, origins
+
+
+def format_code(code: List[str]) -> List[str]:
+    lines = []
+    for raw_line in code:
+        indent = '' if raw_line.endswith('--') else '\t'
+        lines.append(f"{indent}{raw_line.split(';--')[0].strip()}")
+
+    return lines
+
+
+class Fragment(NamedTuple):
+    """Formatted code of some top-level statements generated on their own, see FRISC_generator.fragment."""
+    code: List[str]
+    source_map: List[Optional[SourceOrigin]]
+    variables: List[str]
+    multiply_or_divide: bool
+
+
+def read_lines(source: Union[os.PathLike, BinaryIO]) -> Iterator[str]:
+    """Lines of a path or a binary stream one at a time, a regular file is mapped instead of read.
+
+    A copy of the one in ppj-lab1, every lab is handed in on its own.
+    """
+    if isinstance(source, os.PathLike):
+        with open(source, 'rb') as f:
+            yield from read_lines(f)
+        return
+
+    mapped = None
+    try:
+        if stat.S_ISREG(os.fstat(source.fileno()).st_mode):
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            mapped.seek(source.tell())
+    except (AttributeError, OSError, ValueError):
+        # pipes, terminals, in-memory streams and empty files are read line by line
+        mapped = None
+
+    try:
+        for line in iter(mapped.readline, b'') if mapped is not None else source:
+            # splitlines also breaks on a lone \r, like it did on the whole text
+            yield from line.decode().splitlines() or ['']
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
 class AST_parser:
-    def __init__(self, lines: List[str]):
-        if len(lines) <= 2:
+    def __init__(self, lines: Iterable[str]):
+        # only the first lines are looked at up front, the rest is parsed as it is read
+        lines = iter(lines)
+        head = [Line(line) for line in islice(lines, 3)]
+        if len(head) <= 2:
             raise IllegalStateError("Invalid input")
 
-        self.lines = [Line(line) for line in lines]
-        if self.lines[0].value != "<program>":
+        self.lines = chain(head, map(Line, lines))
+        if head[0].value != "<program>":
             raise IllegalStateError("Invalid input")
 
     def run(self) -> InstructionBlock:
-        block = InstructionBlock.parse(self.lines[1:])
+        return AST_parser.from_tree(Node.parse(self.lines))
+
+    @staticmethod
+    def from_tree(tree) -> InstructionBlock:
+        if tree.label != "<program>" or len(tree.children) != 1:
+            raise IllegalStateError("Invalid input")
+
+        block = InstructionBlock.from_node(tree.children[0])
         if block is None:
             raise IllegalStateError("Invalid input")
 
@@ -462,76 +1376,125 @@ class AST_parser:
 
 
 class FRISC_generator:
-    def __init__(self, input):
+    def __init__(self, input, options: Optional[Options] = None):
         self.input = input
-        self.raw_lines = input.splitlines()
-        self.parser = AST_parser(self.raw_lines)
-        self.root = self.parser.run()
-
-        self.code = [
-            '; Generated by FRISC generator',
-            'MOVE 40000, R7 ; stack pointer',
-            ''
-        ]
+        self.options = options or Options()
+        if isinstance(input, str):
+            self.root = AST_parser(input.splitlines()).run()
+        elif isinstance(input, os.PathLike) or hasattr(input, 'read'):
+            self.root = AST_parser(read_lines(input)).run()
+        else:
+            self.root = AST_parser.from_tree(input)
+
+        self.context = CompilationContext(self.options)
+        self.peephole = Peephole()
+        self.code = list(PROLOGUE)
+        # parallel to code, after generate parallel to the returned lines
+        self.source_map: List[Optional[SourceOrigin]] = [None] * len(self.code)
+
+    def emit(self, lines: List[str], origin: Optional[SourceOrigin] = None):
+        self.code.extend(lines)
+        self.source_map.extend([origin] * len(lines))
 
-    def handle_instructions(self, instructions: List[Instruction], scope=[]):
+    def handle_instructions(self, instructions: List[Instruction], ctx: CompilationContext):
         for instruction in instructions:
             if isinstance(instruction, ForLoopOperation):
                 if instruction.block is None:
                     continue
 
-                inner_path = [*scope, instruction.uuid]
+                instruction.uuid = ctx.unique(f"FOR_{instruction.idn}")
+                ctx.push_scope(instruction.uuid)
+                ctx.add(instruction.idn, f"{instruction.uuid}_var")
 
-                store.add(instruction.idn, inner_path,
-                          f"{instruction.uuid}_var")
+                origin = SourceOrigin(instruction.line, instruction.NODE)
+                self.emit([f"; FOR_START", *instruction.get_init(ctx)], origin)
 
-                self.code.append(f"; FOR_START")
-                self.code.extend(instruction.get_init(inner_path))
-
-                self.code.append(f'; block')
+                self.emit([f'; block'])
                 self.handle_instructions(
                     instruction.block.instructions(),
-                    inner_path
+                    ctx
                 )
 
-                self.code.append(f"; condition")
-                self.code.extend(instruction.get_condition(inner_path))
+                origin = SourceOrigin(instruction.end_line, instruction.NODE)
+                self.emit([f"; condition", *instruction.get_condition(ctx)], origin)
 
-                self.code.append(f"; FOR_END")
-                self.code.append('')
+                self.emit([f"; FOR_END", ''])
 
+                ctx.pop_scope()
                 continue
 
-            if isinstance(instruction, AssignOperation):
-                if not store.exists(instruction.idn, scope):
-                    unique_path = [*scope, instruction.idn]
-                    store.add(instruction.idn, scope, "__".join(unique_path))
-
-            self.code.append(f"; {instruction.__class__.__name__}")
-            self.code.extend(instruction.to_asm(scope))
-            self.code.append('')
-
-    def run(self, output_file: str, print_to_stdout=False):
-        self.handle_instructions(self.root.instructions())
-        self.code.append('')
+            if isinstance(instruction, (AssignOperation, DeclareOperation)):
+                if not ctx.exists(instruction.idn):
+                    unique_path = [*ctx.scope, instruction.idn]
+                    ctx.add(instruction.idn, "__".join(unique_path))
 
-        self.code.append(f'LOAD R6, ({store.get("rez")})')
-        self.code.append('HALT')
-        self.code.append('')
+            if isinstance(instruction, DeclareOperation):
+                continue
 
-        self.code.append('; Global variables')
-        for var in store.list():
-            self.code.append(f"{var} DW 0 ;--")
+            origin = SourceOrigin(instruction.line, instruction.NODE)
+            self.emit([f"; {instruction.__class__.__name__}", *instruction.to_asm(ctx), ''], origin)
+
+    def fold_constants(self):
+        blocks = [self.root]
+        while blocks:
+            for instruction in blocks.pop().instructions():
+                instruction.fold()
+                if isinstance(instruction, ForLoopOperation) and instruction.block is not None:
+                    blocks.append(instruction.block)
+
+    def generate(self) -> List[str]:
+        ctx = self.context
+        if self.options.fold_constants:
+            self.fold_constants()
+        if self.options.eliminate_dead_stores:
+            DeadStoreElimination().run(self.root)
+
+        self.handle_instructions(self.root.instructions(), ctx)
+
+        # the epilogue loads rez even when nothing assigns it
+        ctx.get('rez')
+        variables = [var for var in ctx.list()
+                     if not self.options.eliminate_dead_stores or var in ctx.referenced]
+        lines, origins = epilogue(ctx, variables)
+        self.code.extend(lines)
+        self.source_map.extend(origins)
+
+        if ctx.options.peephole:
+            self.code = self.peephole.run(self.code, self.source_map)
+            self.source_map = self.peephole.origins
+
+        return format_code(self.code)
+
+    def fragment(self, defined: Iterable[str], namespace: str) -> Fragment:
+        """Generates the statements without prologue and epilogue, for splicing between other fragments.
+
+        defined are the top-level variables earlier statements declared, they keep their own names
+        as labels. Dead store elimination needs the whole program and is not run here.
+        """
+        ctx = self.context
+        ctx.namespace = namespace
+        for name in defined:
+            if not ctx.exists(name):
+                ctx.add(name, name)
+        seeded = set(ctx.list())
+
+        if self.options.fold_constants:
+            self.fold_constants()
+
+        self.code, self.source_map = [], []
+        self.handle_instructions(self.root.instructions(), ctx)
+        if ctx.options.peephole:
+            self.code = self.peephole.run(self.code, self.source_map)
+            self.source_map = self.peephole.origins
+
+        variables = [var for var in ctx.list() if var not in seeded]
+        return Fragment(format_code(self.code), self.source_map, variables, ctx.has_multiply_or_divide)
 
-        if store.has_multiply_or_divide:
-            self.code.append('')
-            self.code.extend(MULTIPLY_AND_DIVIDE_OPERATIONS.splitlines())
+    def run(self, output_file: str, print_to_stdout=False):
+        lines = self.generate()
 
         with open(output_file, 'w') as f:
-            for raw_line in self.code:
-                indent = '' if raw_line.endswith('--') else '\t'
-                line = f"{indent}{raw_line.split(';--')[0].strip()}"
-
+            for line in lines:
                 print(line, file=f)
                 if print_to_stdout:
                     print(line)
@@ -539,4 +1502,4 @@ class FRISC_generator:
 
 if __name__ == '__main__':
     name = 'a.frisc' if len(sys.argv) < 2 else sys.argv[1]
-    FRISC_generator(sys.stdin.read()).run(name, print_to_stdout=False)
+    FRISC_generator(sys.stdin.buffer).run(name, print_to_stdout=False)
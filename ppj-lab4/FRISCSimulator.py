@@ -0,0 +1,504 @@
+import re
+import sys
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+WORD = 0xFFFFFFFF
+SIGN = 0x80000000
+MEMORY_SIZE = 256 * 1024
+
+NUMBER = re.compile(r"(%[BODH])?\s*([+-]?[0-9A-Fa-f]+)$")
+BASES = {'%B': 2, '%O': 8, '%D': 10, '%H': 16, None: 16}
+REGISTERS = {**{f"R{i}": i for i in range(8)}, 'SP': 7}
+
+# flags are kept in a list as [C, V, N, Z]
+CONDITIONS: Dict[str, Optional[Callable[[List[int]], bool]]] = {
+    '': None,
+    'N': lambda f: f[2] == 1,
+    'M': lambda f: f[2] == 1,
+    'NN': lambda f: f[2] == 0,
+    'P': lambda f: f[2] == 0,
+    'C': lambda f: f[0] == 1,
+    'UGE': lambda f: f[0] == 1,
+    'NC': lambda f: f[0] == 0,
+    'ULT': lambda f: f[0] == 0,
+    'V': lambda f: f[1] == 1,
+    'NV': lambda f: f[1] == 0,
+    'Z': lambda f: f[3] == 1,
+    'EQ': lambda f: f[3] == 1,
+    'NZ': lambda f: f[3] == 0,
+    'NE': lambda f: f[3] == 0,
+    'ULE': lambda f: f[0] == 0 or f[3] == 1,
+    'UGT': lambda f: f[0] == 1 and f[3] == 0,
+    'SLT': lambda f: f[2] != f[1],
+    'SLE': lambda f: f[2] != f[1] or f[3] == 1,
+    'SGE': lambda f: f[2] == f[1],
+    'SGT': lambda f: f[2] == f[1] and f[3] == 0,
+}
+
+
+class FRISCError(Exception):
+    def __init__(self, line: int, message: str):
+        self.line = line
+        self.message = message
+
+    def __str__(self):
+        return f"line {self.line}: {self.message}"
+
+
+class Statement(NamedTuple):
+    line: int
+    label: Optional[str]
+    op: str
+    operands: List[str]
+
+
+class Execution(NamedTuple):
+    r6: int
+    cycles: int
+    registers: Tuple[int, ...]
+
+
+class Profile(NamedTuple):
+    """Executed instructions per .pj line and per runtime routine, other covers the prologue and HALT."""
+    execution: Execution
+    lines: Dict[int, int]
+    nodes: Dict[int, List[str]]
+    routines: Dict[str, int]
+    other: int
+
+    def report(self) -> str:
+        cycles = self.execution.cycles or 1
+        rows = [f"R6 {self.execution.r6}, {self.execution.cycles} cycles", '', 'line  cycles      %  node']
+        for line, count in sorted(self.lines.items()):
+            rows.append(f"{line:4}  {count:6}  {100 * count / cycles:5.1f}  {' '.join(self.nodes[line])}")
+
+        if self.routines:
+            rows.extend(['', 'routine     cycles      %'])
+            for routine, count in sorted(self.routines.items(), key=lambda item: -item[1]):
+                rows.append(f"{routine:10}  {count:6}  {100 * count / cycles:5.1f}")
+
+        rows.extend(['', f"other       {self.other:6}  {100 * self.other / cycles:5.1f}"])
+        return '\n'.join(rows)
+
+
+def signed(value: int) -> int:
+    return value - (1 << 32) if value & SIGN else value
+
+
+def parse(source: str) -> List[Statement]:
+    """Splits the program into labels, ops and operands, labels start in the first column."""
+    statements = []
+    for number, text in enumerate(source.splitlines(), 1):
+        code = text.split(';', 1)[0].rstrip()
+        if not code.strip():
+            continue
+
+        label = None
+        if not code[0].isspace():
+            label, *rest = code.split(None, 1)
+            code = rest[0] if rest else ''
+
+        parts = code.split(None, 1)
+        op = parts[0].upper() if parts else ''
+        operands = [operand.strip() for operand in parts[1].split(',')] if len(parts) > 1 else []
+        statements.append(Statement(number, label, op, operands))
+
+    return statements
+
+
+class FRISCSimulator:
+    """Assembles a FRISC program into a pre-decoded instruction array and runs it through a dispatch table.
+
+    Covers the subset FRISCGenerator emits: MOVE, LOAD, STORE, PUSH, POP, the ALU instructions,
+    CMP, JP, CALL, RET and HALT with their conditions, plus DW, `DS, `ORG, `EQU and `END.
+    Flags follow vm/friscjs.js, instructions occupy their words but read back as 0 from memory.
+    """
+
+    def __init__(self, source: str, memory_size: int = MEMORY_SIZE):
+        self.memory = [0] * (memory_size // 4)
+        self.registers = [0] * 8
+        self.flags = [0, 0, 0, 0]
+        self.labels: Dict[str, int] = {}
+
+        # indexed by word address, None where there is no instruction
+        self.program: List[Optional[tuple]] = [None] * len(self.memory)
+        self.lines: List[int] = [0] * len(self.memory)
+
+        self.handlers = self.dispatch()
+        self.assemble(parse(source))
+
+    def run(self, max_cycles: Optional[int] = None) -> Execution:
+        program = self.program
+        limit = sys.maxsize if max_cycles is None else max_cycles
+        pc = 0
+        cycles = 0
+
+        try:
+            while cycles < limit:
+                handler, a, b, c = program[pc]
+                cycles += 1
+                pc = handler(pc + 1, a, b, c)
+                if pc is None:
+                    break
+            else:
+                raise FRISCError(0, f"no HALT after {limit} cycles")
+        except (IndexError, TypeError):
+            line = self.lines[pc] if 0 <= pc < len(self.lines) else 0
+            raise FRISCError(line, f"nothing to execute at {pc * 4:#x}") from None
+
+        registers = tuple(signed(value) for value in self.registers)
+        return Execution(registers[6], cycles, registers)
+
+    def profile(self, max_cycles: Optional[int] = None) -> Tuple[Execution, List[int]]:
+        """Runs like run and counts executions per source line, kept apart so run stays a tight loop."""
+        program = self.program
+        limit = sys.maxsize if max_cycles is None else max_cycles
+        counts = [0] * len(program)
+        pc = 0
+        cycles = 0
+
+        try:
+            while cycles < limit:
+                handler, a, b, c = program[pc]
+                counts[pc] += 1
+                cycles += 1
+                pc = handler(pc + 1, a, b, c)
+                if pc is None:
+                    break
+            else:
+                raise FRISCError(0, f"no HALT after {limit} cycles")
+        except (IndexError, TypeError):
+            line = self.lines[pc] if 0 <= pc < len(self.lines) else 0
+            raise FRISCError(line, f"nothing to execute at {pc * 4:#x}") from None
+
+        per_line = [0] * (max(self.lines) + 1)
+        for index, count in enumerate(counts):
+            if count:
+                per_line[self.lines[index]] += count
+
+        registers = tuple(signed(value) for value in self.registers)
+        return Execution(registers[6], cycles, registers), per_line
+
+    def assemble(self, statements: List[Statement]):
+        # first pass places every statement, the second decodes them once all labels are known
+        address = 0
+        placed = []
+        for statement in statements:
+            if statement.op == '`END':
+                break
+
+            if statement.op == '`EQU':
+                self.labels[statement.label] = self.number(statement, statement.operands[0])
+                continue
+
+            if statement.label is not None:
+                self.labels[statement.label] = address
+
+            if statement.op == '`ORG':
+                address = self.number(statement, statement.operands[0])
+            elif statement.op == '`DS':
+                address += self.number(statement, statement.operands[0])
+            elif statement.op == 'DW':
+                placed.append((address, statement))
+                address += 4 * len(statement.operands)
+            elif statement.op:
+                placed.append((address, statement))
+                address += 4
+
+        for address, statement in placed:
+            if address % 4:
+                raise FRISCError(statement.line, f"{statement.op} is not word aligned")
+
+            index = address // 4
+            if statement.op == 'DW':
+                for offset, operand in enumerate(statement.operands):
+                    self.memory[index + offset] = self.value(statement, operand) & WORD
+                continue
+
+            self.program[index] = self.decode(statement)
+            self.lines[index] = statement.line
+
+    def decode(self, statement: Statement) -> tuple:
+        op, _, condition = statement.op.partition('_')
+        operands = statement.operands
+        h = self.handlers
+
+        if op in ['JP', 'CALL', 'RET', 'HALT']:
+            if condition not in CONDITIONS:
+                raise FRISCError(statement.line, f"unknown condition {condition}")
+
+            test = CONDITIONS[condition]
+            if op in ['RET', 'HALT']:
+                return h[op], test, None, None
+
+            target = operands[0]
+            if target in REGISTERS:
+                return h[f"{op}_REG"], test, REGISTERS[target], None
+
+            return h[op], test, self.address(statement, target) // 4, None
+
+        if op == 'MOVE':
+            source, dest = operands
+            if source in REGISTERS:
+                return h['MOVE_REG'], REGISTERS[source], None, self.register(statement, dest)
+
+            return h['MOVE'], self.immediate(statement, source), None, self.register(statement, dest)
+
+        if op in ['LOAD', 'STORE']:
+            register, location = operands
+            register = self.register(statement, register)
+            inner = location.strip()[1:-1].replace(' ', '')
+            base, sign, offset = re.match(r"(?:(R[0-7]|SP)(?=[+-]|$))?([+-]?)(.*)$", inner).groups()
+            if base is None:
+                return h[op], register, self.address(statement, inner) // 4, None
+
+            offset = self.value(statement, f"{sign}{offset}") if offset else 0
+            return h[f"{op}_REG"], register, REGISTERS[base], offset
+
+        if op in ['PUSH', 'POP']:
+            return h[op], self.register(statement, operands[0]), None, None
+
+        if op == 'CMP':
+            source, operand = operands
+            if operand in REGISTERS:
+                return h['CMP_REG'], self.register(statement, source), REGISTERS[operand], None
+
+            return h['CMP'], self.register(statement, source), self.immediate(statement, operand), None
+
+        if op in h and len(operands) == 3:
+            source, operand, dest = operands
+            if operand in REGISTERS:
+                return h[f"{op}_REG"], self.register(statement, source), REGISTERS[operand], self.register(statement, dest)
+
+            return h[op], self.register(statement, source), self.immediate(statement, operand), self.register(statement, dest)
+
+        raise FRISCError(statement.line, f"unsupported instruction {statement.op}")
+
+    def register(self, statement: Statement, operand: str) -> int:
+        if operand not in REGISTERS:
+            raise FRISCError(statement.line, f"expected a register, got {operand}")
+
+        return REGISTERS[operand]
+
+    def number(self, statement: Statement, operand: str) -> int:
+        match = NUMBER.match(operand.strip())
+        if match is None:
+            raise FRISCError(statement.line, f"invalid number {operand}")
+
+        base, digits = match.groups()
+        try:
+            return int(digits, BASES[base])
+        except ValueError:
+            raise FRISCError(statement.line, f"invalid number {operand}") from None
+
+    def value(self, statement: Statement, operand: str) -> int:
+        operand = operand.strip()
+        if operand in self.labels:
+            return self.labels[operand]
+
+        return self.number(statement, operand)
+
+    def immediate(self, statement: Statement, operand: str) -> int:
+        """20 bit immediates are sign extended to a word, like the assembler the number has to survive that."""
+        value = self.value(statement, operand) & WORD
+        low = value & 0xFFFFF
+        if (low | 0xFFF00000 if low & 0x80000 else low) != value:
+            raise FRISCError(statement.line, f"{operand} can't be obtained by sign-extending its lower 20 bits")
+
+        return value
+
+    def address(self, statement: Statement, operand: str) -> int:
+        return self.immediate(statement, operand) & ~3
+
+    def dispatch(self) -> Dict[str, Callable]:
+        """Handlers take the next pc and three decoded operands and return the pc to continue at, None halts."""
+        r = self.registers
+        mem = self.memory
+        f = self.flags
+
+        def add(x, y, carry=0):
+            total = x + y + carry
+            res = total & WORD
+            f[0] = total >> 32
+            f[1] = ((x ^ res) & (y ^ res)) >> 31
+            f[2] = res >> 31
+            f[3] = int(res == 0)
+            return res
+
+        def sub(x, y, carry=0):
+            res = add(x, -y & WORD, carry)
+            if y == 0:
+                f[0] = 1
+            return res
+
+        def logic(res):
+            f[0] = f[1] = 0
+            f[2] = res >> 31
+            f[3] = int(res == 0)
+            return res
+
+        def shift(res, carry):
+            logic(res)
+            f[0] = carry
+            return res
+
+        def shl(x, y):
+            k = y & 0x1F
+            return shift((x << k) & WORD, (x >> (32 - k)) & 1 if k else 0)
+
+        def shr(x, y):
+            k = y & 0x1F
+            return shift(x >> k, (x >> (k - 1)) & 1 if k else 0)
+
+        def ashr(x, y):
+            k = y & 0x1F
+            return shift(((x - ((x & SIGN) << 1)) >> k) & WORD, (x >> (k - 1)) & 1 if k else 0)
+
+        operations = {
+            'ADD': add,
+            'ADC': lambda x, y: add(x, y, f[0]),
+            'SUB': sub,
+            'SBC': lambda x, y: sub(x, y, f[0]),
+            'AND': lambda x, y: logic(x & y),
+            'OR': lambda x, y: logic(x | y),
+            'XOR': lambda x, y: logic(x ^ y),
+            'SHL': shl,
+            'SHR': shr,
+            'ASHR': ashr,
+        }
+
+        def alu(operation):
+            def immediate(pc, s, value, d):
+                r[d] = operation(r[s], value)
+                return pc
+
+            def register(pc, s, t, d):
+                r[d] = operation(r[s], r[t])
+                return pc
+
+            return immediate, register
+
+        handlers = {}
+        for name, operation in operations.items():
+            handlers[name], handlers[f"{name}_REG"] = alu(operation)
+
+        def cmp(pc, s, value, _):
+            sub(r[s], value)
+            return pc
+
+        def cmp_reg(pc, s, t, _):
+            sub(r[s], r[t])
+            return pc
+
+        def move(pc, value, _, d):
+            r[d] = value
+            return pc
+
+        def move_reg(pc, s, _, d):
+            r[d] = r[s]
+            return pc
+
+        def load(pc, d, index, _):
+            r[d] = mem[index]
+            return pc
+
+        def load_reg(pc, d, base, offset):
+            r[d] = mem[((r[base] + offset) & WORD) >> 2]
+            return pc
+
+        def store(pc, s, index, _):
+            mem[index] = r[s]
+            return pc
+
+        def store_reg(pc, s, base, offset):
+            mem[((r[base] + offset) & WORD) >> 2] = r[s]
+            return pc
+
+        def push(pc, s, _, __):
+            r[7] = (r[7] - 4) & WORD
+            mem[r[7] >> 2] = r[s]
+            return pc
+
+        def pop(pc, d, _, __):
+            r[d] = mem[r[7] >> 2]
+            r[7] = (r[7] + 4) & WORD
+            return pc
+
+        def jp(pc, test, index, _):
+            return index if test is None or test(f) else pc
+
+        def jp_reg(pc, test, t, _):
+            return r[t] >> 2 if test is None or test(f) else pc
+
+        # like friscjs CALL pushes its own address and RET continues after it
+        def call(pc, test, index, _):
+            if test is not None and not test(f):
+                return pc
+
+            r[7] = (r[7] - 4) & WORD
+            mem[r[7] >> 2] = (pc - 1) * 4
+            return index
+
+        def call_reg(pc, test, t, _):
+            return call(pc, test, r[t] >> 2, None)
+
+        def ret(pc, test, _, __):
+            if test is not None and not test(f):
+                return pc
+
+            index = mem[r[7] >> 2] >> 2
+            r[7] = (r[7] + 4) & WORD
+            return index + 1
+
+        def halt(pc, test, _, __):
+            return None if test is None or test(f) else pc
+
+        handlers.update({
+            'CMP': cmp, 'CMP_REG': cmp_reg,
+            'MOVE': move, 'MOVE_REG': move_reg,
+            'LOAD': load, 'LOAD_REG': load_reg,
+            'STORE': store, 'STORE_REG': store_reg,
+            'PUSH': push, 'POP': pop,
+            'JP': jp, 'JP_REG': jp_reg,
+            'CALL': call, 'CALL_REG': call_reg,
+            'RET': ret, 'HALT': halt,
+        })
+        return handlers
+
+
+def profile(source: str, source_map: Sequence, max_cycles: Optional[int] = None) -> Profile:
+    """Runs a generated program, source_map holds an origin with line and node for every line of source."""
+    execution, counts = FRISCSimulator(source).profile(max_cycles)
+
+    lines: Dict[int, int] = {}
+    nodes: Dict[int, List[str]] = {}
+    routines: Dict[str, int] = {}
+    other = 0
+    for number, count in enumerate(counts):
+        if not count:
+            continue
+
+        origin = source_map[number - 1] if 0 < number <= len(source_map) else None
+        if origin is None:
+            other += count
+        elif origin.line:
+            lines[origin.line] = lines.get(origin.line, 0) + count
+            names = nodes.setdefault(origin.line, [])
+            if origin.node not in names:
+                names.append(origin.node)
+        else:
+            routines[origin.node] = routines.get(origin.node, 0) + count
+
+    return Profile(execution, lines, nodes, routines, other)
+
+
+if __name__ == '__main__':
+    source = open(sys.argv[1]).read() if len(sys.argv) > 1 else sys.stdin.read()
+    try:
+        execution = FRISCSimulator(source).run()
+    except FRISCError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    print(execution.r6)
+    print(f"cycles: {execution.cycles}", file=sys.stderr)
@@ -0,0 +1,62 @@
+import os
+from dataclasses import replace
+
+from FRISCGenerator import FRISC_generator, Options
+from FRISCSimulator import FRISCSimulator
+
+# generated programs that run longer than this are treated as stuck
+MAX_CYCLES = 10 ** 8
+
+# every fixture is also compiled with each optimization turned off, they must not change R6
+VARIANTS = {
+    'default': Options(),
+    'no fold_constants': replace(Options(), fold_constants=False),
+    'no allocate_registers': replace(Options(), allocate_registers=False),
+    'linear runtime': replace(Options(), runtime='linear'),
+    'no hoist_loop_bounds': replace(Options(), hoist_loop_bounds=False),
+    'no peephole': replace(Options(), peephole=False),
+    'no eliminate_dead_stores': replace(Options(), eliminate_dead_stores=False),
+}
+
+
+def load_file(filename):
+    with open(filename, 'r') as f:
+        return f.read()
+
+
+def load_test(test):
+    input_string = load_file(os.path.join('./tests', test, 'test.in'))
+    expected_output = load_file(os.path.join('./tests', test, 'test.out'))
+
+    return input_string, expected_output
+
+
+if __name__ == '__main__':
+    tests = sorted(os.listdir('./tests'))
+    score = 0
+    cycles = 0
+
+    for variant, options in VARIANTS.items():
+        passed = 0
+        for test in tests:
+            input_string, expected_output = load_test(test)
+
+            try:
+                code = '\n'.join(FRISC_generator(input_string, options).generate())
+                execution = FRISCSimulator(code).run(MAX_CYCLES)
+            except Exception as e:
+                print(f"Run: ./tests/{test}/test.out failed ({variant}): {e}")
+                continue
+
+            if options == Options():
+                cycles += execution.cycles
+            if str(execution.r6) == expected_output.strip():
+                passed += 1
+            else:
+                print(f"Test: ./tests/{test}/test.out failed ({variant}), R6 was {execution.r6}")
+
+        print(f"{variant}: {passed}/{len(tests)}")
+        score += passed
+
+    print(f'Score: {score}/{len(tests) * len(VARIANTS)}')
+    print(f'Cycles: {cycles}')
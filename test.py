@@ -0,0 +1,283 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from compiler import ROOT, FRISC_generator, SemanticAnalyzer, SyntaxAnalyzer  # noqa: F401 sets up sys.path
+from LeksickiAnalizator import process
+from FRISCSimulator import FRISCSimulator
+
+# generated programs that run longer than this are treated as stuck
+MAX_CYCLES = 10 ** 8
+
+
+class Stages:
+    """Times every stage of a case, each stage returns what the next one works on."""
+
+    def __init__(self):
+        self.times: Dict[str, float] = {}
+
+    def run(self, name: str, function: Callable, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.times[name] = time.perf_counter() - start
+
+
+def captured(function: Callable[[], None]) -> str:
+    # StringIO grows its buffer in place, unlike the += the per-lab MyStringIO used to do
+    io = StringIO()
+    with redirect_stdout(io):
+        function()
+    return io.getvalue()
+
+
+def lab1(source: str, stages: Stages) -> str:
+    return stages.run('lex', captured, lambda: process(source))
+
+
+def lab2(source: str, stages: Stages) -> str:
+    return stages.run('parse', captured, lambda: SyntaxAnalyzer(source).run())
+
+
+def lab3(source: str, stages: Stages) -> str:
+    return stages.run('semantic', captured, lambda: SemanticAnalyzer(source).run())
+
+
+def lab3_all(source: str, stages: Stages) -> str:
+    return stages.run('semantic --all', captured, lambda: SemanticAnalyzer(source, all_errors=True).run())
+
+
+def lab4(source: str, stages: Stages) -> str:
+    code = stages.run('generate', lambda: '\n'.join(FRISC_generator(source).generate()))
+    execution = stages.run('simulate', lambda: FRISCSimulator(code).run(MAX_CYCLES))
+    return f"{execution.r6}\n"
+
+
+class Lab(NamedTuple):
+    input: str
+    expected: str
+    run: Callable[[str, Stages], str]
+    # lab4 only compares R6, so surrounding whitespace does not count
+    strip: bool = False
+    # other expected files a case may have, each checked against its own run on the same input
+    extra: Dict[str, Callable[[str, Stages], str]] = {}
+
+
+LABS = {
+    'ppj-lab1': Lab('pj', 'in', lab1),
+    'ppj-lab2': Lab('in', 'out', lab2),
+    'ppj-lab3': Lab('in', 'out', lab3, extra={'all': lab3_all}),
+    'ppj-lab4': Lab('in', 'out', lab4, strip=True),
+}
+
+
+class Case(NamedTuple):
+    lab: str
+    name: str
+    path: str
+
+
+class Result(NamedTuple):
+    lab: str
+    name: str
+    passed: bool
+    error: Optional[str]
+    times: Dict[str, float]
+    peak: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.lab}/{self.name}"
+
+    @property
+    def time(self) -> float:
+        return sum(self.times.values())
+
+
+def discover(labs: List[str]) -> List[Case]:
+    cases = []
+    for lab in labs:
+        directory = os.path.join(ROOT, lab, 'tests')
+        for name in sorted(os.listdir(directory)):
+            if os.path.isdir(os.path.join(directory, name)):
+                cases.append(Case(lab, name, os.path.join(directory, name)))
+
+    return cases
+
+
+def find_case_file(case: Case, extension: str) -> Optional[str]:
+    """Some cases name their files Test.* instead of test.*."""
+    for name in os.listdir(case.path):
+        if name.lower() == f"test.{extension}":
+            return os.path.join(case.path, name)
+
+    return None
+
+
+def case_file(case: Case, extension: str) -> str:
+    path = find_case_file(case, extension)
+    if path is None:
+        raise FileNotFoundError(f"{case.path} has no test.{extension}")
+
+    return path
+
+
+def read_file(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def timeout(signum, frame):
+    raise TimeoutError
+
+
+def run_case(case: Case, seconds: float) -> Result:
+    """Runs in a worker, SIGALRM interrupts a case that takes too long where the platform has it."""
+    lab = LABS[case.lab]
+    stages = Stages()
+    error = None
+    # every output with what it should be
+    checks: List[Tuple[str, str]] = []
+
+    alarm = seconds and hasattr(signal, 'SIGALRM')
+    if alarm:
+        signal.signal(signal.SIGALRM, timeout)
+
+    tracemalloc.start()
+    try:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, seconds)
+
+        source = read_file(case_file(case, lab.input))
+        checks.append((lab.run(source, stages), read_file(case_file(case, lab.expected))))
+        for extension, run in lab.extra.items():
+            path = find_case_file(case, extension)
+            if path is not None:
+                checks.append((run(source, stages), read_file(path)))
+    except TimeoutError:
+        error = f"timed out after {seconds}s"
+    except Exception as e:
+        error = f"{e.__class__.__name__}: {e}"
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    passed = False
+    if error is None:
+        if lab.strip:
+            passed = all(output.strip() == expected.strip() for output, expected in checks)
+        else:
+            passed = all(output == expected for output, expected in checks)
+        if not passed:
+            error = 'wrong output'
+
+    return Result(case.lab, case.name, passed, error, stages.times, peak)
+
+
+def run_all(cases: List[Case], workers: Optional[int] = None, seconds: float = 10) -> List[Result]:
+    if not cases:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(run_case, cases, [seconds] * len(cases)))
+
+
+def slowdowns(results: List[Result], baseline: Dict[str, dict], tolerance: float) -> List[Tuple[Result, float]]:
+    """Cases slower than tolerance times their baseline, a millisecond of jitter is always allowed."""
+    slow = []
+    for result in results:
+        before = baseline.get(result.key)
+        if before is None or not result.passed:
+            continue
+
+        if result.time > before['time'] * tolerance + 1e-3:
+            slow.append((result, before['time']))
+
+    return slow
+
+
+def milliseconds(seconds: float) -> str:
+    return f"{seconds * 1000:8.2f} ms"
+
+
+def report(results: List[Result], verbose: bool):
+    for result in results:
+        if verbose:
+            stages = ' '.join(f"{stage} {time * 1000:.2f}" for stage, time in result.times.items())
+            status = 'ok  ' if result.passed else 'FAIL'
+            print(f"{status} {result.key:40} {milliseconds(result.time)} {result.peak // 1024:6} KiB  {stages}")
+        elif not result.passed:
+            print(f"FAIL {result.key}: {result.error}")
+
+    print()
+    for lab in LABS:
+        own = [result for result in results if result.lab == lab]
+        if not own:
+            continue
+
+        passed = sum(result.passed for result in own)
+        totals: Dict[str, float] = {}
+        for result in own:
+            for stage, time in result.times.items():
+                totals[stage] = totals.get(stage, 0) + time
+
+        stages = '  '.join(f"{stage}{milliseconds(time)}" for stage, time in totals.items())
+        peak = max(result.peak for result in own) // 1024
+        print(f"{lab}  {passed:3}/{len(own):<3}  peak {peak:6} KiB  {stages}")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Runs the tests of every lab on a worker pool')
+    parser.add_argument('labs', nargs='*', metavar='LAB',
+                        help=f"labs to test out of {', '.join(LABS)}, all of them by default")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes, defaults to the CPU count')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='seconds a single case may take, 0 disables the limit')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print time and peak memory of every case')
+    parser.add_argument('--save', metavar='FILE',
+                        help='write the timings as json, to compare later runs against')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='timings saved by an earlier run, slower cases count as failures')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='how many times slower than the baseline a case may get')
+    args = parser.parse_args(argv)
+    for lab in args.labs:
+        if lab not in LABS:
+            parser.error(f"unknown lab {lab}")
+
+    results = run_all(discover(args.labs or list(LABS)), args.jobs, args.timeout)
+    report(results, args.verbose)
+
+    slow = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            slow = slowdowns(results, json.load(f), args.tolerance)
+        for result, before in slow:
+            print(f"SLOW {result.key}: {milliseconds(result.time).strip()} was {milliseconds(before).strip()}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({result.key: {'time': result.time, 'times': result.times, 'peak': result.peak}
+                       for result in results}, f, indent=2)
+
+    score = sum(result.passed for result in results)
+    print(f'Score: {score}/{len(results)}')
+    return 1 if score != len(results) or slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,139 @@
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiler import Options, compile, compile_cached, main, open_cache  # noqa: E402
+from cache import CompilationCache, Entry  # noqa: E402
+
+SOURCE = 'rez = 0\nza i od 1 do 3\n  rez = rez + i * 2\naz\n'
+
+
+def files(directory):
+    return sorted(os.path.join(path, name) for path, _, names in os.walk(directory) for name in names)
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary.cleanup)
+        self.directory = self.temporary.name
+
+    def test_hit_after_rebuild(self):
+        entry, cached = compile_cached(SOURCE, open_cache(self.directory))
+        self.assertFalse(cached)
+        self.assertEqual(entry.text, compile(SOURCE).frisc())
+
+        # a new build opens the cache again, like the next run of compiler.py would
+        cache = open_cache(self.directory)
+        again, cached = compile_cached(SOURCE, cache)
+        self.assertTrue(cached)
+        self.assertEqual(again, entry)
+        self.assertEqual(cache.misses, 0)
+
+    def test_miss_when_options_change(self):
+        cache = open_cache(self.directory)
+        compile_cached(SOURCE, cache)
+
+        options = Options(eliminate_dead_stores=False, peephole=False)
+        entry, cached = compile_cached(SOURCE, cache, options)
+        self.assertFalse(cached)
+        # the tokens and the tree do not depend on the options and still come from the cache
+        self.assertEqual(cache.hits, 2)
+
+        _, cached = compile_cached(SOURCE, cache, options)
+        self.assertTrue(cached)
+
+    def test_errors_are_cached(self):
+        cache = open_cache(self.directory)
+        entry, cached = compile_cached('x = y\n', cache)
+        self.assertEqual((entry.text, entry.error, cached), (None, 'err 1 y', False))
+
+        again, cached = compile_cached('x = y\n', open_cache(self.directory))
+        self.assertEqual((again, cached), (entry, True))
+
+    def test_truncated_program_in_batch(self):
+        sources = {'a.pj': 'za\n', 'b.pj': 'za i od 1 do\naz\n', 'c.pj': SOURCE}
+        for name, source in sources.items():
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.write(source)
+        paths = [os.path.join(self.directory, name) for name in sources]
+        cache = os.path.join(self.directory, 'cache')
+
+        # the parser fails on these with IndexError, cached builds report it like uncached ones
+        with redirect_stdout(StringIO()) as plain:
+            self.assertEqual(main(['--batch', *paths, '-j', '1']), 1)
+        for cached in range(2):
+            with redirect_stdout(StringIO()) as output:
+                self.assertEqual(main(['--batch', *paths, '-j', '1', '--cache', cache]), 1)
+            expected = plain.getvalue().replace('Compiled 1/3\n', f"Compiled 1/3, {cached * 3} from cache\n")
+            self.assertEqual(output.getvalue(), expected)
+        self.assertIn(f"{paths[0]}: IndexError: list index out of range\n", plain.getvalue())
+
+    def test_salt_changes_key(self):
+        plain = CompilationCache(self.directory)
+        salted = CompilationCache(self.directory, salts={'tree': 'edited'})
+
+        self.assertEqual(plain.key('tokens', SOURCE), salted.key('tokens', SOURCE))
+        self.assertNotEqual(plain.key('tree', SOURCE), salted.key('tree', SOURCE))
+
+        plain.put(plain.key('tree', SOURCE), Entry('tree', None))
+        self.assertIsNone(salted.get(salted.key('tree', SOURCE)))
+
+    def test_put_replaces_atomically(self):
+        cache = CompilationCache(self.directory)
+        key = cache.key('frisc', SOURCE)
+        cache.put(key, Entry('old', None))
+        cache.put(key, Entry('new', None))
+
+        self.assertEqual(files(self.directory), [cache.path(key)])
+        self.assertEqual(cache.get(key), Entry('new', None))
+
+        # an interrupted write leaves the previous entry and no temporary file behind
+        with mock.patch('cache.os.replace', side_effect=OSError):
+            with self.assertRaises(OSError):
+                cache.put(key, Entry('lost', None))
+        self.assertEqual(files(self.directory), [cache.path(key)])
+        self.assertEqual(cache.get(key), Entry('new', None))
+
+    def test_evict_least_recently_used(self):
+        cache = CompilationCache(self.directory)
+        keys = [cache.key('frisc', str(i)) for i in range(4)]
+        for i, key in enumerate(keys):
+            cache.put(key, Entry('x' * 100, None))
+            os.utime(cache.path(key), (1000 + i, 1000 + i))
+
+        # a hit makes the oldest entry the most recently used one
+        cache.get(keys[0])
+        size = os.path.getsize(cache.path(keys[0]))
+        cache.max_size = 2 * size
+
+        self.assertEqual(cache.evict(), 2)
+        self.assertEqual(files(self.directory), sorted([cache.path(keys[0]), cache.path(keys[3])]))
+        self.assertEqual(cache.evict(), 0)
+
+    def test_cache_size_option(self):
+        source = os.path.join(self.directory, 'program.pj')
+        with open(source, 'w') as f:
+            f.write(SOURCE)
+        cache = os.path.join(self.directory, 'cache')
+
+        with redirect_stdout(StringIO()) as output:
+            self.assertEqual(main(['--batch', source, '-j', '1', '--cache', cache]), 0)
+        self.assertEqual(output.getvalue(), 'Compiled 1/1, 0 from cache\n')
+        self.assertEqual(len(files(cache)), 3)
+
+        with redirect_stdout(StringIO()) as output:
+            self.assertEqual(main(['--batch', source, '-j', '1', '--cache', cache, '--cache-size', '0']), 0)
+        self.assertEqual(output.getvalue(), 'Compiled 1/1, 1 from cache\n')
+        self.assertEqual(files(cache), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiler import SemanticError, SyntaxError, compile  # noqa: E402
+from incremental import IncrementalCompiler  # noqa: E402
+from FRISCSimulator import FRISCSimulator  # noqa: E402
+
+SOURCE = """rez = 0
+x = 2
+za i od 1 do 3
+  rez = rez + x * i
+az
+y = rez / 2
+rez = rez + y
+"""
+
+# every edit is applied to the source the one before it left behind
+EDITS = [
+    ('change a constant', 'x = 2\n', 'x = 5\n'),
+    ('change a loop body', '  rez = rez + x * i\n', '  rez = rez + x * i - 1\n'),
+    ('insert a statement', 'y = rez / 2\n', 'z = 7\ny = rez / 2 + z\n'),
+    ('move a statement', 'rez = 0\nx = 5\n', 'x = 5\nrez = 0\n'),
+    ('add a comment and a blank line', 'z = 7\n', '// z\n\nz = 7\n'),
+    ('remove a statement', 'rez = rez + y\n', ''),
+    ('use rez before it is assigned', 'rez = 0\n', ''),
+    ('remove every rez assignment', '  rez = rez + x * i - 1\naz\n', '  w = x * i - 1\naz\n'),
+    ('remove every use of rez', 'y = rez / 2 + z\n', 'y = x / 2 + z\n'),
+]
+
+
+def run(code):
+    return FRISCSimulator('\n'.join(code)).run(10 ** 6).r6
+
+
+class IncrementalCompilerTest(unittest.TestCase):
+
+    def test_edits_match_compile(self):
+        compiler = IncrementalCompiler()
+        source = SOURCE
+        self.assertEqual(run(compiler.update(source)), run(compile(source).code))
+
+        for name, old, new in EDITS:
+            with self.subTest(name):
+                self.assertIn(old, source)
+                source = source.replace(old, new, 1)
+                try:
+                    expected = run(compile(source).code)
+                except SemanticError as e:
+                    with self.assertRaises(SemanticError) as raised:
+                        compiler.update(source)
+                    self.assertEqual(str(raised.exception), str(e))
+                    continue
+
+                self.assertEqual(run(compiler.update(source)), expected)
+                self.assertFalse(compiler.full)
+
+    def test_unchanged_statements_are_reused(self):
+        compiler = IncrementalCompiler()
+        compiler.update(SOURCE)
+        compiler.update(SOURCE.replace('x = 2\n', 'x = 5\n'))
+
+        self.assertFalse(compiler.full)
+        self.assertEqual(compiler.generated, 1)
+        self.assertEqual(compiler.reused, 4)
+
+    def test_without_rez_assignment(self):
+        compiler = IncrementalCompiler()
+        compiler.update(SOURCE)
+        source = 'x = 2\nza i od 1 do 3\n  y = x * i\naz\n'
+
+        self.assertEqual(run(compiler.update(source)), 0)
+        self.assertEqual(run(compile(source).code), 0)
+
+    def test_errors_match_compile(self):
+        compiler = IncrementalCompiler()
+        compiler.update(SOURCE)
+
+        for source, error in [(SOURCE + 'x = w\n', SemanticError), (SOURCE + 'x = (1\ny = 2\n', SyntaxError)]:
+            with self.assertRaises(error) as expected:
+                compile(source)
+            with self.assertRaises(error) as raised:
+                compiler.update(source)
+            self.assertEqual(str(raised.exception), str(expected.exception))
+            self.assertTrue(compiler.full)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import unittest
+from io import BytesIO, StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import compiler  # noqa: E402,F401 sets up sys.path
+import LeksickiAnalizator as lab1  # noqa: E402
+import SemantickiAnalizator as lab3  # noqa: E402
+from SintaksniAnalizator import SyntaxAnalyzer, SyntaxError  # noqa: E402
+
+# small enough that every fixture is written in several chunks
+CHUNK_SIZE = 16
+
+
+def fixtures(lab):
+    """Yields every test directory with its files by lowercase name, some tests use Test.*."""
+    directory = os.path.join(ROOT, lab, 'tests')
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            yield name, {found.lower(): os.path.join(path, found) for found in os.listdir(path)}
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def parse(tokens):
+    """The tree dump, or the error for the fixtures that only test the lexer."""
+    try:
+        return str(SyntaxAnalyzer(tokens).parse())
+    except SyntaxError as e:
+        return str(e)
+
+
+class LexerRecordsTest(unittest.TestCase):
+
+    def test_records_match_text(self):
+        for name, files in fixtures('ppj-lab1'):
+            with self.subTest(name):
+                source = read(files['test.pj'])
+
+                text = StringIO()
+                lab1.process(source, lab1.TextWriter(text, CHUNK_SIZE))
+                records = BytesIO()
+                lab1.process(source, lab1.RecordWriter(records, CHUNK_SIZE))
+
+                tokens = list(lab1.read_records(records.getvalue()))
+                self.assertEqual(''.join(f"{token}\n" for token in tokens), text.getvalue())
+                self.assertEqual(text.getvalue(), read(files['test.in']))
+
+    def test_records_parse_like_text(self):
+        for name, files in fixtures('ppj-lab1'):
+            with self.subTest(name):
+                records = BytesIO()
+                lab1.process(read(files['test.pj']), lab1.RecordWriter(records, CHUNK_SIZE))
+
+                self.assertEqual(parse(lab1.read_records(records.getvalue())), parse(read(files['test.in'])))
+
+
+class SemanticRecordsTest(unittest.TestCase):
+
+    @staticmethod
+    def lines(records):
+        for line_number, def_line_number, idn in lab3.read_records(records):
+            yield f"err {line_number} {idn}\n" if def_line_number == 0 else f"{line_number} {def_line_number} {idn}\n"
+
+    def test_records_match_text(self):
+        for name, files in fixtures('ppj-lab3'):
+            for expected, all_errors in [('test.out', False), ('test.all', True)]:
+                if expected not in files:
+                    continue
+
+                with self.subTest(name, all_errors=all_errors):
+                    tree = read(files['test.in'])
+
+                    text = StringIO()
+                    lab3.SemanticAnalyzer(tree, all_errors).run(lab3.TextWriter(text, CHUNK_SIZE))
+                    records = BytesIO()
+                    lab3.SemanticAnalyzer(tree, all_errors).run(lab3.RecordWriter(records, CHUNK_SIZE))
+
+                    self.assertEqual(''.join(self.lines(records.getvalue())), text.getvalue())
+                    self.assertEqual(text.getvalue(), read(files[expected]))
+
+
+if __name__ == '__main__':
+    unittest.main()